@@ -0,0 +1,111 @@
+import os
+import re
+import time
+import json
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+ANSWER_CACHE_PATH = os.getenv("ANSWER_CACHE_PATH", os.path.join(".kb_cache", "answers.sqlite3"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", str(24 * 3600)))
+ANSWER_CACHE_MEMORY_ENTRIES = int(os.getenv("ANSWER_CACHE_MEMORY_ENTRIES", "256"))
+ANSWER_CACHE_DISK_ENTRIES = int(os.getenv("ANSWER_CACHE_DISK_ENTRIES", "10000"))
+
+
+# Function to normalise a prompt so trivially different spellings share a cache entry
+def normalize_prompt(prompt):
+    return re.sub(r"\s+", " ", str(prompt).lower()).strip().rstrip("?!. ")
+
+
+# Function to get the conversation before the current prompt, for the cache key. The
+# current turn is left out because the key already holds its normalised form.
+def history_context(prompt, messages):
+    history = list(messages)
+    if history and history[-1].get("role") == "user" and normalize_prompt(history[-1]["content"]) == normalize_prompt(prompt):
+        history = history[:-1]
+    return "\n".join(f"{msg['role']}: {msg['content']}" for msg in history)
+
+
+# Function to build the cache key for an answer from everything that shapes it
+def make_cache_key(prompt, row_ids, context, data_version):
+    payload = json.dumps(
+        [normalize_prompt(prompt), [int(row) for row in row_ids], hashlib.sha256(context.encode('utf-8')).hexdigest(), str(data_version)]
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+# Two-tier answer cache: an in-memory LRU in front of an SQLite table.
+# Both tiers expire entries after the TTL and evict least-recently-used
+# entries once they exceed their size limit.
+class AnswerCache:
+    def __init__(self, path=ANSWER_CACHE_PATH, ttl=ANSWER_CACHE_TTL, memory_entries=ANSWER_CACHE_MEMORY_ENTRIES, disk_entries=ANSWER_CACHE_DISK_ENTRIES):
+        self.ttl = ttl
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self.memory = OrderedDict()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+        self._lock = threading.Lock()
+        self.path = path
+        self._db = None
+        self._pid = None
+
+    # The SQLite connection for this process, opened on first use. A connection must
+    # not be used across fork() (gunicorn --preload), so each worker opens its own.
+    @property
+    def db(self):
+        if self._db is None or self._pid != os.getpid():
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            db = sqlite3.connect(self.path, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("CREATE TABLE IF NOT EXISTS answers (key TEXT PRIMARY KEY, answer TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)")
+            db.execute("CREATE INDEX IF NOT EXISTS answers_accessed ON answers (accessed)")
+            db.commit()
+            self._db, self._pid = db, os.getpid()
+        return self._db
+
+    def _remember(self, key, answer, created):
+        self.memory[key] = (answer, created)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self.memory.get(key)
+            if entry is not None and now - entry[1] < self.ttl:
+                self.memory.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return entry[0]
+            self.memory.pop(key, None)
+
+            row = self.db.execute("SELECT answer, created FROM answers WHERE key = ?", (key,)).fetchone()
+            if row is not None and now - row[1] < self.ttl:
+                self.db.execute("UPDATE answers SET accessed = ? WHERE key = ?", (now, key))
+                self.db.commit()
+                self._remember(key, row[0], row[1])
+                self.stats["disk_hits"] += 1
+                return row[0]
+
+            self.stats["misses"] += 1
+            return None
+
+    def set(self, key, answer):
+        now = time.time()
+        with self._lock:
+            self._remember(key, answer, now)
+            self.db.execute("INSERT OR REPLACE INTO answers (key, answer, created, accessed) VALUES (?, ?, ?, ?)", (key, answer, now, now))
+            self.db.execute("DELETE FROM answers WHERE created < ?", (now - self.ttl,))
+            overflow = self.db.execute("SELECT COUNT(*) FROM answers").fetchone()[0] - self.disk_entries
+            if overflow > 0:
+                self.db.execute("DELETE FROM answers WHERE key IN (SELECT key FROM answers ORDER BY accessed LIMIT ?)", (overflow,))
+                self.stats["evictions"] += overflow
+            self.db.commit()
+
+    def hit_rate(self):
+        hits = self.stats["memory_hits"] + self.stats["disk_hits"]
+        total = hits + self.stats["misses"]
+        return hits / total if total else 0.0
@@ -0,0 +1,211 @@
+"""HTTP/JSON API over the chat engine, as a dependency-free ASGI app.
+
+Run with any ASGI server, e.g.:
+    uvicorn api:app --port 8000
+    gunicorn api:app -k uvicorn.workers.UvicornWorker -w 4 --preload
+
+With --preload the knowledge base and indexes are loaded once in the master
+process (API_PRELOAD=1, the default) and shared copy-on-write by the workers;
+SQLite connections (answer cache, tickets, query counts) are opened in each worker.
+
+Endpoints:
+    GET  /healthz                  -> {"status": "ok", "version": ..., "dedupe": {"rows", "canonical_rows", ...}}
+    GET  /faq                      -> {"questions": [...], "clusters": [{"label", "count", "subjects"}, ...]}
+    GET  /metrics                  -> Prometheus text format (per-stage latency, tokens, cache hit rates)
+    GET  /metrics.json             -> the same metrics plus recent spans, as JSON
+    POST /retrieve   {"prompt", "k"}                 -> {"rows": [...], "replies": [{"reply", "additional_comments", "row", "count"}, ...]}
+    POST /answer     {"prompt", "messages", "stream"} -> {"answer", "rows", "usage", "cached", "coalesced"} or a text stream
+    POST /categorize {"query", "faq_term"}          -> {"sub_category": ...}
+    POST /summarize  {"text"}                        -> {"subject": ...}
+    POST /tickets    {"sub_category", "subject", "details", "transcript"} -> {"number": ...}
+"""
+import os
+import json
+import asyncio
+import logging
+from engine import get_engine
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+API_PRELOAD = os.getenv("API_PRELOAD", "1") == "1"
+MAX_BODY_BYTES = 1 << 20
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+async def _read_json(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if len(body) > MAX_BODY_BYTES:
+            raise HTTPError(413, "Request body too large")
+        if not message.get("more_body"):
+            break
+    try:
+        return json.loads(body or b"{}")
+    except ValueError:
+        raise HTTPError(400, "Request body must be JSON")
+
+
+async def _send_json(send, status, payload):
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _send_text(send, status, text, content_type=b"text/plain; charset=utf-8"):
+    body = text.encode("utf-8")
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", content_type), (b"content-length", str(len(body)).encode())]})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _send_stream(send, tokens):
+    await send({"type": "http.response.start", "status": 200,
+                "headers": [(b"content-type", b"text/plain; charset=utf-8")]})
+    loop = asyncio.get_running_loop()
+    iterator = iter(tokens)
+    try:
+        while True:
+            # The LLM stream blocks, so pull each fragment on a worker thread
+            token = await loop.run_in_executor(None, next, iterator, None)
+            if token is None:
+                break
+            await send({"type": "http.response.body", "body": token.encode("utf-8"), "more_body": True})
+    except Exception:
+        # Headers are already sent, so the best we can do is end the body early
+        logger.exception("Answer stream failed")
+    await send({"type": "http.response.body", "body": b""})
+
+
+def _require(payload, key):
+    value = payload.get(key)
+    if not isinstance(value, str) or not value.strip():
+        raise HTTPError(400, f"'{key}' is required")
+    return value
+
+
+def _optional(payload, key, types, default=None):
+    value = payload.get(key)
+    if value is None:
+        return default
+    if not isinstance(value, types):
+        raise HTTPError(400, f"'{key}' has the wrong type (expected {types.__name__})")
+    return value
+
+
+def _positive_int(payload, key, default):
+    value = _optional(payload, key, int, default)
+    if isinstance(value, bool) or value < 1:
+        raise HTTPError(400, f"'{key}' must be a positive integer")
+    return value
+
+
+def _messages(payload, key):
+    value = _optional(payload, key, list)
+    if value is not None and not all(isinstance(msg, dict) and isinstance(msg.get("role"), str)
+                                     and isinstance(msg.get("content"), str) for msg in value):
+        raise HTTPError(400, f"'{key}' must be a list of {{\"role\", \"content\"}} objects")
+    return value
+
+
+async def _handle(method, path, payload, send):
+    engine = get_engine()
+    run = asyncio.get_running_loop().run_in_executor
+
+    if method == "GET" and path == "/healthz":
+        state = await run(None, engine.current)
+        return await _send_json(send, 200, {"status": "ok", "version": state.version, "dedupe": state.dedupe.report(state.search_index)})
+
+    if method == "GET" and path == "/metrics":
+        return await _send_text(send, 200, metrics.render_prometheus(), b"text/plain; version=0.0.4; charset=utf-8")
+
+    if method == "GET" and path == "/metrics.json":
+        return await _send_json(send, 200, metrics.snapshot())
+
+    if method == "GET" and path == "/faq":
+        def faq():
+            questions = engine.faq_questions()
+            return {"questions": questions, "clusters": engine.faq_clusters(len(questions))}
+        return await _send_json(send, 200, await run(None, faq))
+
+    if method == "POST" and path == "/retrieve":
+        prompt = _require(payload, "prompt")
+        k = _positive_int(payload, "k", 5)
+
+        # Rows and replies come from the same knowledge-base version, read off the event loop
+        def retrieve():
+            state = engine.current()
+            rows = engine.retrieve(prompt, k, state)
+            replies = [dict(zip(("reply", "additional_comments"), state.kb.replies(row)), row=row, count=state.dedupe.count(row)) for row in rows]
+            return {"rows": rows, "replies": replies}
+        return await _send_json(send, 200, await run(None, retrieve))
+
+    if method == "POST" and path == "/answer":
+        prompt = _require(payload, "prompt")
+        messages = _messages(payload, "messages") or [{"role": "user", "content": prompt}]
+        stream = bool(payload.get("stream"))
+        await run(None, engine.popularity.record, prompt)
+        answer = await run(None, engine.answer, prompt, messages, stream)
+        if stream:
+            return await _send_stream(send, answer.tokens)
+        return await _send_json(send, 200, {"answer": answer.text, "rows": answer.rows, "usage": answer.usage, "cached": answer.cached, "coalesced": answer.coalesced})
+
+    if method == "POST" and path == "/categorize":
+        return await _send_json(send, 200, {"sub_category": engine.categorize(_require(payload, "query"), _optional(payload, "faq_term", str))})
+
+    if method == "POST" and path == "/summarize":
+        return await _send_json(send, 200, {"subject": engine.summarize(_optional(payload, "text", str, ""))})
+
+    if method == "POST" and path == "/tickets":
+        number = engine.log_ticket(
+            _require(payload, "sub_category"),
+            _require(payload, "subject"),
+            _optional(payload, "details", str, ""),
+            _optional(payload, "transcript", list, []),
+        )
+        return await _send_json(send, 201, {"number": number})
+
+    raise HTTPError(404, "Not found")
+
+
+# ASGI entry point
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    if scope["type"] != "http":
+        return
+
+    try:
+        payload = await _read_json(receive) if scope["method"] == "POST" else {}
+        if not isinstance(payload, dict):
+            raise HTTPError(400, "Request body must be a JSON object")
+        await _handle(scope["method"], scope["path"], payload, send)
+    except HTTPError as e:
+        await _send_json(send, e.status, {"error": e.message})
+    except Exception as e:
+        logger.exception("Unhandled error for %s %s", scope["method"], scope["path"])
+        await _send_json(send, 500, {"error": str(e)})
+
+
+# Load the knowledge base and indexes at import so preforked workers share them
+if API_PRELOAD:
+    try:
+        get_engine().current()
+    except Exception:
+        logger.exception("Could not preload the knowledge base; it will be loaded on first request")
@@ -0,0 +1,123 @@
+"""Categorise and summarise ITSM CSV exports in bulk.
+
+Usage:
+    python batch_categorize.py user_log.csv categorized.parquet --workers 8 --chunksize 50000
+
+The input is streamed in chunks and fanned out over a process pool, so memory
+stays flat regardless of file size. The output keeps every input column and
+adds "Predicted Sub Category" and "Summarized Subject". Writing Parquet needs
+pyarrow; any other extension is written as CSV.
+"""
+import os
+import sys
+import time
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from categorizer import determine_sub_category, summarize_user_input
+from kb_loader import has_cp1252_undefined
+
+
+# Function to pick the file encoding with the same cp1252 -> ISO-8859-1 rule as read_data_from_s3,
+# scanning the file in blocks instead of decoding it whole
+def detect_encoding(path, block_size=1 << 20):
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                return 'cp1252'
+            if has_cp1252_undefined(block):
+                return 'ISO-8859-1'
+
+
+# Function to categorise and summarise one chunk of tickets (runs in a worker process)
+def categorize_chunk(chunk):
+    details = chunk["Details of Query"] if "Details of Query" in chunk else pd.Series([''] * len(chunk), index=chunk.index)
+    subjects = chunk["Subject"] if "Subject" in chunk else pd.Series([''] * len(chunk), index=chunk.index)
+
+    categories = []
+    summaries = []
+    for detail, subject in zip(details, subjects):
+        # Same rule as the app: the detail first, falling back to the subject
+        categories.append(determine_sub_category(detail, subject))
+        summaries.append(summarize_user_input(detail or subject))
+
+    chunk["Predicted Sub Category"] = categories
+    chunk["Summarized Subject"] = summaries
+    return chunk
+
+
+# Writes chunks to CSV or Parquet as they complete, without holding them in memory
+class ChunkWriter:
+    def __init__(self, path):
+        self.path = path
+        self.parquet = path.lower().endswith(".parquet")
+        self.writer = None
+        self.started = False
+
+    def write(self, chunk):
+        if self.parquet:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if self.writer is None:
+                self.writer = pq.ParquetWriter(self.path, table.schema)
+            self.writer.write_table(table)
+        else:
+            chunk.to_csv(self.path, mode='a' if self.started else 'w', header=not self.started, index=False)
+        self.started = True
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+# Function to run the pipeline; returns (rows processed, seconds taken)
+def run(input_path, output_path, chunksize=50000, workers=None, log=sys.stderr):
+    encoding = detect_encoding(input_path)
+    reader = pd.read_csv(input_path, encoding=encoding, chunksize=chunksize, dtype=str, keep_default_na=False)
+    writer = ChunkWriter(output_path)
+    workers = workers or os.cpu_count() or 1
+
+    rows = 0
+    started = time.perf_counter()
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # Keep a bounded number of chunks in flight and write them back in input order
+            pending = deque()
+            for chunk in reader:
+                pending.append(pool.submit(categorize_chunk, chunk))
+                if len(pending) >= workers * 2:
+                    rows += _drain_one(pending, writer, rows, started, log)
+            while pending:
+                rows += _drain_one(pending, writer, rows, started, log)
+    finally:
+        writer.close()
+
+    elapsed = time.perf_counter() - started
+    print(f"Processed {rows} rows in {elapsed:.2f}s ({rows / elapsed if elapsed else 0:.0f} rows/s) -> {output_path}", file=log)
+    return rows, elapsed
+
+
+def _drain_one(pending, writer, rows_so_far, started, log):
+    chunk = pending.popleft().result()
+    writer.write(chunk)
+    rows = rows_so_far + len(chunk)
+    elapsed = time.perf_counter() - started
+    print(f"{rows} rows, {rows / elapsed if elapsed else 0:.0f} rows/s", file=log)
+    return len(chunk)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Categorise and summarise ITSM CSV exports in bulk.")
+    parser.add_argument("input", help="ITSM CSV export (cp1252 or ISO-8859-1)")
+    parser.add_argument("output", help="output file; .parquet for Parquet, anything else for CSV")
+    parser.add_argument("--chunksize", type=int, default=50000, help="rows per chunk (default: 50000)")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    args = parser.parse_args(argv)
+    run(args.input, args.output, args.chunksize, args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""Local stand-in for the OpenAI chat completions API, for load tests.
+
+Usage (from the repository root):
+    python -m benchmarks.fake_openai --port 5556 --latency 0.8 --token-delay 0.02
+    OPENAI_API_BASE=http://127.0.0.1:5556/v1 OPENAI_API_KEY=sk-fake streamlit run _main.py
+
+Answers POST /v1/chat/completions, streamed (server-sent events) or not, after
+--latency seconds, with --token-delay seconds between streamed words. FAQ
+question prompts are answered with the term as a question, anything else with
+a canned reply that quotes the end of the prompt.
+"""
+import re
+import sys
+import json
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+QUESTION_TERM = re.compile(r"Transform '(.+?)' directly")
+
+
+# Function to make the reply for a request's messages
+def fake_reply(messages):
+    last = str(messages[-1]["content"]) if messages else ""
+    match = QUESTION_TERM.search(last)
+    if match:
+        return f"{match.group(1)}?"
+    tail = last.strip().splitlines()[-1].strip() if last.strip() else ""
+    return f"Thank you for your query. Based on similar past queries, please try the steps in the user guide for: {tail[-80:]}"
+
+
+def _chunk(content, finish_reason=None):
+    delta = {"content": content} if content is not None else {}
+    return {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()), "model": "fake",
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            return self._send(404, {"error": {"message": f"Unknown path {self.path}"}})
+        server.count(bool(body.get("stream")))
+        reply = fake_reply(body.get("messages", []))
+        time.sleep(server.latency)
+
+        if not body.get("stream"):
+            return self._send(200, {
+                "id": "chatcmpl-fake", "object": "chat.completion", "created": int(time.time()), "model": "fake",
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            })
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        words = reply.split(" ")
+        for i, word in enumerate(words):
+            if i and server.token_delay:
+                time.sleep(server.token_delay)
+            self.wfile.write(f"data: {json.dumps(_chunk(word if i == len(words) - 1 else word + ' '))}\n\n".encode("utf-8"))
+            self.wfile.flush()
+        self.wfile.write(f"data: {json.dumps(_chunk(None, 'stop'))}\n\ndata: [DONE]\n\n".encode("utf-8"))
+
+    def _send(self, status, payload):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# The fake API on a background thread; requests and streams count the calls served
+class FakeOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, token_delay=0.0):
+        super().__init__((host, port), _Handler)
+        self.latency = latency
+        self.token_delay = token_delay
+        self.requests = 0
+        self.streams = 0
+        self._lock = threading.Lock()
+        self.thread = None
+
+    def count(self, stream):
+        with self._lock:
+            self.requests += 1
+            self.streams += stream
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, name="fake-openai", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5556)
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds before each response starts")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="seconds between streamed words")
+    args = parser.parse_args(argv)
+
+    server = FakeOpenAIServer(args.host, args.port, args.latency, args.token_delay)
+    print(f"Fake OpenAI API at {server.url}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
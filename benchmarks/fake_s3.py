@@ -0,0 +1,167 @@
+"""Local stand-in for the S3 API calls the app makes, for load tests.
+
+Usage (from the repository root):
+    python -m benchmarks.fake_s3 --port 5555 --rows 100000 --latency 0.02
+    AWS_ENDPOINT_URL=http://127.0.0.1:5555 BUCKET_NAME=load-test-bucket streamlit run _main.py
+
+Serves HEAD/GET object (with Range and If-Match) and ListObjectsV2 over HTTP,
+path-style, from memory; requests are not authenticated. The command line
+serves one synthetic knowledge base; the load test puts objects directly.
+"""
+import sys
+import time
+import hashlib
+import argparse
+import threading
+from email.utils import formatdate
+from urllib.parse import urlsplit, parse_qs, unquote
+from xml.sax.saxutils import escape
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LIST_PAGE_SIZE = 1000
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _target(self):
+        url = urlsplit(self.path)
+        bucket, _, key = url.path.lstrip("/").partition("/")
+        return unquote(bucket), unquote(key), parse_qs(url.query)
+
+    def do_HEAD(self):
+        self.server.count("head_object")
+        bucket, key, _ = self._target()
+        obj = self.server.objects.get((bucket, key))
+        if obj is None:
+            return self._send(404, b"")
+        self._send(200, b"", obj, length=len(obj["body"]), head=True)
+
+    def do_GET(self):
+        bucket, key, query = self._target()
+        if not key:
+            self.server.count("list_objects_v2")
+            return self._list(bucket, query)
+
+        self.server.count("get_object")
+        obj = self.server.objects.get((bucket, key))
+        if obj is None:
+            return self._error(404, "NoSuchKey", f"s3://{bucket}/{key} does not exist")
+        if_match = self.headers.get("If-Match")
+        if if_match and if_match != obj["etag"]:
+            return self._error(412, "PreconditionFailed", "At least one of the pre-conditions you specified did not hold")
+
+        body = obj["body"]
+        byte_range = self.headers.get("Range")
+        if byte_range:
+            start, _, end = byte_range.replace("bytes=", "").partition("-")
+            start, end = int(start), min(int(end) if end else len(body) - 1, len(body) - 1)
+            return self._send(206, body[start:end + 1], obj, content_range=f"bytes {start}-{end}/{len(body)}")
+        self._send(200, body, obj)
+
+    def _list(self, bucket, query):
+        prefix = query.get("prefix", [""])[0]
+        after = query.get("continuation-token", query.get("start-after", [""]))[0]
+        keys = sorted(key for b, key in self.server.objects if b == bucket and key.startswith(prefix) and key > after)
+        page, truncated = keys[:LIST_PAGE_SIZE], len(keys) > LIST_PAGE_SIZE
+        contents = "".join(
+            f"<Contents><Key>{escape(key)}</Key><LastModified>{self.server.objects[(bucket, key)]['iso_modified']}</LastModified>"
+            f"<ETag>{escape(self.server.objects[(bucket, key)]['etag'])}</ETag><Size>{len(self.server.objects[(bucket, key)]['body'])}</Size>"
+            f"<StorageClass>STANDARD</StorageClass></Contents>"
+            for key in page
+        )
+        token = f"<NextContinuationToken>{escape(page[-1])}</NextContinuationToken>" if truncated else ""
+        xml = (f'<?xml version="1.0" encoding="UTF-8"?><ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">'
+               f"<Name>{escape(bucket)}</Name><Prefix>{escape(prefix)}</Prefix><KeyCount>{len(page)}</KeyCount>"
+               f"<MaxKeys>{LIST_PAGE_SIZE}</MaxKeys><IsTruncated>{str(truncated).lower()}</IsTruncated>{token}{contents}</ListBucketResult>")
+        self._send(200, xml.encode("utf-8"), content_type="application/xml")
+
+    def _error(self, status, code, message):
+        xml = f'<?xml version="1.0" encoding="UTF-8"?><Error><Code>{code}</Code><Message>{escape(message)}</Message></Error>'
+        self._send(status, xml.encode("utf-8"), content_type="application/xml")
+
+    def _send(self, status, body, obj=None, length=None, head=False, content_range=None, content_type=None):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self.send_response(status)
+        if obj is not None:
+            self.send_header("ETag", obj["etag"])
+            self.send_header("Last-Modified", obj["http_modified"])
+            self.send_header("Accept-Ranges", "bytes")
+        if content_range:
+            self.send_header("Content-Range", content_range)
+        self.send_header("Content-Type", content_type or "binary/octet-stream")
+        self.send_header("Content-Length", str(len(body) if length is None else length))
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# In-memory S3 on a background thread; `calls` counts requests per operation
+class FakeS3Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0):
+        super().__init__((host, port), _Handler)
+        self.latency = latency
+        self.objects = {}
+        self.calls = {}
+        self._lock = threading.Lock()
+        self.thread = None
+
+    def count(self, operation):
+        with self._lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+
+    def put_object(self, Bucket, Key, Body):
+        body = Body if isinstance(Body, bytes) else Body.encode("utf-8")
+        now = time.time()
+        self.objects[(Bucket, Key)] = {
+            "body": body,
+            "etag": '"' + hashlib.md5(body).hexdigest() + '"',
+            "http_modified": formatdate(now, usegmt=True),
+            "iso_modified": time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime(now)),
+        }
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, name="fake-s3", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5555)
+    parser.add_argument("--bucket", default="load-test-bucket")
+    parser.add_argument("--key", default="Good_copy_fixed_anonymised_data.csv")
+    parser.add_argument("--rows", type=int, default=20000, help="rows in the synthetic knowledge base")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to each request")
+    args = parser.parse_args(argv)
+
+    from benchmarks.synthetic import generate_corpus, to_csv_bytes
+    server = FakeS3Server(args.host, args.port, args.latency)
+    server.put_object(Bucket=args.bucket, Key=args.key, Body=to_csv_bytes(generate_corpus(args.rows)))
+    print(f"Fake S3 at {server.url} serving s3://{args.bucket}/{args.key}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
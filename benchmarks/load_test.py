@@ -0,0 +1,410 @@
+"""Concurrent-session load test of the Streamlit app.
+
+Usage (from the repository root, with `pip install websockets`):
+    python -m benchmarks.load_test --concurrency 1 4 16 --sessions 32
+    python -m benchmarks.load_test --concurrency 8 --llm-latency 1.5 --token-delay 0.03 --output load.json
+
+Starts the real app (`streamlit run _main.py`) in a subprocess and drives
+simulated sessions through it with headless websocket clients speaking the
+Streamlit browser protocol. Each session opens the page, enters the password,
+types queries, clicks an FAQ question and logs a ticket. S3 is a local HTTP
+stand-in holding a synthetic knowledge base (benchmarks.fake_s3) and the LLM a
+local fake OpenAI server with configurable latency (benchmarks.fake_openai),
+both reached through the app's real boto3 and openai clients.
+
+For each concurrency level it reports sessions and reruns per second, rerun
+latency percentiles (overall and per step), and the server process's CPU
+(100% = one core) and resident memory. Answers stay cached between levels, as
+they would on a running server.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import platform
+import argparse
+import tempfile
+import subprocess
+import urllib.request
+import numpy as np
+from benchmarks.fake_s3 import FakeS3Server
+from benchmarks.fake_openai import FakeOpenAIServer
+from benchmarks.synthetic import generate_corpus, generate_queries, to_csv_bytes
+
+try:
+    import websockets
+except ImportError:
+    websockets = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAIN_SCRIPT = os.path.join(ROOT, "_main.py")
+PASSWORD = "load-test"
+BUCKET = "load-test-bucket"
+KEY = "Good_copy_fixed_anonymised_data.csv"
+STEPS = ["open", "password", "query", "faq_click", "ticket"]
+TICKET_LOGGED = "has been logged successfully"
+
+
+# Function to build the app's environment, pointing it at the local stand-ins
+def app_environment(workdir, s3_url, llm_url, args):
+    env = dict(os.environ)
+    env.pop("KB_PREFIX", None)
+    env.update({
+        "PYTHONPATH": os.pathsep.join(filter(None, [ROOT, env.get("PYTHONPATH")])),
+        "PASSWORD": PASSWORD,
+        "AWS_ENDPOINT_URL": s3_url,
+        "ACCESS_KEY": "load-test",
+        "SECRET_ACCESS_KEY": "load-test",
+        "REGION_NAME": "us-east-1",
+        "BUCKET_NAME": BUCKET,
+        "KB_FILE_KEY": KEY,
+        "OPENAI_API_KEY": "sk-load-test",
+        "OPENAI_API_BASE": llm_url,
+        "LLM_BACKEND": "openai",
+        "LLM_RATE_LIMIT": str(args.llm_rate_limit),
+        "LLM_BURST": str(max(1, int(args.llm_rate_limit))),
+        "STREAM_RESPONSES": "1" if args.stream else "0",
+        "KB_SNAPSHOT_DIR": os.path.join(workdir, "snapshots"),
+        "FAQ_CACHE_PATH": os.path.join(workdir, "faq.json"),
+        "EMBEDDING_CACHE_DIR": os.path.join(workdir, "embeddings"),
+        "ANSWER_CACHE_PATH": os.path.join(workdir, "answers.sqlite3"),
+        "TICKET_DB_PATH": os.path.join(workdir, "tickets.sqlite3"),
+        "POPULARITY_PATH": os.path.join(workdir, "popularity.sqlite3"),
+    })
+    return env
+
+
+# Function to start `streamlit run _main.py` and wait until it answers its health check
+def start_app(env, port, log_path, timeout=60):
+    command = [sys.executable, "-m", "streamlit", "run", MAIN_SCRIPT, "--server.headless", "true",
+               "--server.port", str(port), "--server.address", "127.0.0.1", "--browser.gatherUsageStats", "false"]
+    log = open(log_path, "wb")
+    process = subprocess.Popen(command, env=env, cwd=os.path.dirname(log_path), stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"streamlit exited with {process.returncode}; see {log_path}")
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/_stcore/health", timeout=1) as response:
+                if response.status == 200:
+                    return process
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise TimeoutError(f"streamlit did not start within {timeout} seconds; see {log_path}")
+
+
+# CPU time (seconds) and resident memory (bytes) of a process, from /proc (Linux only)
+def process_usage(pid):
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open(f"/proc/{pid}/statm") as f:
+            rss = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None, None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK"), rss
+
+
+# Samples the app process's CPU and memory while a level runs
+class ProcessSampler:
+    def __init__(self, pid, interval=0.2):
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss = 0
+
+    async def _sample(self):
+        while True:
+            _, rss = process_usage(self.pid)
+            self.peak_rss = max(self.peak_rss, rss or 0)
+            await asyncio.sleep(self.interval)
+
+    async def __aenter__(self):
+        self.started = time.perf_counter()
+        self.cpu_started = process_usage(self.pid)[0]
+        self._task = asyncio.ensure_future(self._sample())
+        return self
+
+    async def __aexit__(self, *exc):
+        self._task.cancel()
+        self.wall = time.perf_counter() - self.started
+        cpu, rss = process_usage(self.pid)
+        self.peak_rss = max(self.peak_rss, rss or 0)
+        self.cpu = cpu - self.cpu_started if cpu is not None and self.cpu_started is not None else None
+
+    def summary(self):
+        return {
+            "cpu_seconds": round(self.cpu, 3) if self.cpu is not None else None,
+            "cpu_percent": round(100 * self.cpu / self.wall, 1) if self.cpu is not None and self.wall else None,
+            "peak_rss_mb": round(self.peak_rss / 2 ** 20, 1) if self.peak_rss else None,
+        }
+
+
+# One browser tab: a websocket session that reruns the script with widget values set,
+# the way the frontend does, and keeps the widgets and text of the latest run.
+# Value widgets keep their state across reruns; triggers (buttons, chat input) last one rerun.
+class AppSession:
+    def __init__(self, url, timeout):
+        self.url = url
+        self.timeout = timeout
+        self.values = {}  # widget id -> WidgetState with a persistent value
+        self.widgets = []  # (element type, element proto) of the latest run
+        self.texts = []
+
+    async def __aenter__(self):
+        self.ws = await websockets.connect(self.url, subprotocols=["streamlit"], max_size=None, open_timeout=self.timeout)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.ws.close()
+
+    # Rerun the script and read its output until it finishes; returns whether it ran without an exception
+    async def rerun(self, trigger=None):
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+        msg = BackMsg()
+        msg.rerun_script.query_string = ""
+        msg.rerun_script.page_script_hash = ""
+        for state in self.values.values():
+            msg.rerun_script.widget_states.widgets.add().CopyFrom(state)
+        if trigger is not None:
+            msg.rerun_script.widget_states.widgets.add().CopyFrom(trigger)
+        await self.ws.send(msg.SerializeToString())
+
+        self.widgets, self.texts, ok = [], [], True
+        while True:
+            forward = ForwardMsg()
+            forward.ParseFromString(await asyncio.wait_for(self.ws.recv(), self.timeout))
+            kind = forward.WhichOneof("type")
+            if kind == "script_finished":
+                # A run that calls st.rerun() is followed by another run on the same request
+                if forward.script_finished == ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+                    self.widgets, self.texts = [], []
+                    continue
+                return ok and forward.script_finished == ForwardMsg.FINISHED_SUCCESSFULLY
+            if kind != "delta" or forward.delta.WhichOneof("type") != "new_element":
+                continue
+            element = forward.delta.new_element
+            element_type = element.WhichOneof("type")
+            if element_type == "exception":
+                ok = False
+            elif element_type == "markdown":
+                self.texts.append(element.markdown.body)
+            elif element_type in ("text_input", "chat_input", "button", "component_instance"):
+                self.widgets.append((element_type, getattr(element, element_type)))
+
+    def find(self, element_type, predicate=lambda widget: True):
+        return [widget for kind, widget in self.widgets if kind == element_type and predicate(widget)]
+
+    def _state(self, widget_id):
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+        state = WidgetState()
+        state.id = widget_id
+        return state
+
+    async def set_text(self, widget, value):
+        state = self._state(widget.id)
+        state.string_value = value
+        self.values[widget.id] = state
+        return await self.rerun()
+
+    # Like an option_menu click: the component reports the chosen option as its value
+    async def set_component(self, widget, value):
+        state = self._state(widget.id)
+        state.json_value = json.dumps(value)
+        self.values[widget.id] = state
+        return await self.rerun()
+
+    async def click(self, widget):
+        state = self._state(widget.id)
+        state.trigger_value = True
+        return await self.rerun(state)
+
+    async def chat(self, widget, text):
+        state = self._state(widget.id)
+        state.chat_input_value.data = text
+        return await self.rerun(state)
+
+
+# Function to run one simulated session; returns (step, seconds, ok) per rerun
+async def run_session(url, queries, weights, rng, args):
+    timings = []
+
+    async def step(name, action):
+        started = time.perf_counter()
+        try:
+            ok = await action
+        except Exception as e:
+            print(f"step {name} failed: {type(e).__name__}: {e}", file=sys.stderr)
+            ok = False
+        timings.append((name, time.perf_counter() - started, ok))
+        return ok
+
+    async with AppSession(url, args.timeout) as session:
+        if not await step("open", session.rerun()):
+            return timings
+        password = session.find("text_input", lambda widget: widget.label == "Password")
+        if password and not await step("password", session.set_text(password[0], PASSWORD)):
+            return timings
+
+        for query in rng.choices(queries, weights, k=args.queries_per_session):
+            chat_input = session.find("chat_input")
+            if not chat_input:
+                timings.append(("query", 0.0, False))
+                break
+            await step("query", session.chat(chat_input[0], query))
+
+        faq_buttons = session.find("button", lambda widget: "-faq_" in widget.id)
+        if faq_buttons:
+            await step("faq_click", session.click(rng.choice(faq_buttons)))
+
+        if args.tickets:
+            menu = session.find("component_instance", lambda widget: "What would you like to do?" in widget.json_args)
+            if menu:
+                ok = await step("ticket", session.set_component(menu[0], "Log ITSM ticket"))
+                if ok and not any(TICKET_LOGGED in text for text in session.texts):
+                    timings[-1] = ("ticket", timings[-1][1], False)
+    return timings
+
+
+# Function to summarise rerun latencies (seconds) as percentiles in milliseconds
+def latency_summary(latencies):
+    values = np.asarray(latencies, dtype=float) * 1000
+    if not len(values):
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "p50_ms": round(float(np.percentile(values, 50)), 3),
+        "p95_ms": round(float(np.percentile(values, 95)), 3),
+        "p99_ms": round(float(np.percentile(values, 99)), 3),
+        "max_ms": round(float(values.max()), 3),
+    }
+
+
+# Function to run `sessions` sessions, at most `concurrency` at a time, and summarise them
+async def run_level(concurrency, sessions, url, pid, queries, weights, args, llm_server):
+    requests_before = llm_server.requests
+    limit = asyncio.Semaphore(concurrency)
+
+    async def limited(rng):
+        async with limit:
+            return await run_session(url, queries, weights, rng, args)
+
+    rngs = [random.Random(args.seed * 100003 + concurrency * 1009 + i) for i in range(sessions)]
+    async with ProcessSampler(pid) as sampler:
+        results = await asyncio.gather(*(limited(rng) for rng in rngs))
+
+    timings = [timing for session in results for timing in session]
+    return {
+        "concurrency": concurrency,
+        "sessions": sessions,
+        "reruns": len(timings),
+        "errors": sum(not ok for _, _, ok in timings),
+        "wall_seconds": round(sampler.wall, 3),
+        "sessions_per_s": round(sessions / sampler.wall, 3),
+        "reruns_per_s": round(len(timings) / sampler.wall, 3),
+        "llm_requests": llm_server.requests - requests_before,
+        **sampler.summary(),
+        "latency": latency_summary([seconds for _, seconds, _ in timings]),
+        "steps": {name: latency_summary([seconds for step, seconds, _ in timings if step == name])
+                  for name in STEPS if any(step == name for step, _, _ in timings)},
+    }
+
+
+# Function to wait until the app has loaded its engine and FAQ, so levels measure a warm server
+async def warm_up(url, args, timeout=300):
+    started = time.perf_counter()
+    async with AppSession(url, args.timeout) as session:
+        await session.rerun()
+        password = session.find("text_input", lambda widget: widget.label == "Password")
+        if password:
+            await session.set_text(password[0], PASSWORD)
+        while not session.find("button", lambda widget: "-faq_" in widget.id):
+            if time.perf_counter() - started > timeout:
+                raise TimeoutError(f"the FAQ was not ready within {timeout} seconds")
+            await asyncio.sleep(1)
+            await session.rerun()
+    return time.perf_counter() - started
+
+
+def print_level(result):
+    latency = result["latency"]
+    cpu = f"{result['cpu_percent']:6.1f}%" if result["cpu_percent"] is not None else "    n/a"
+    rss = f"{result['peak_rss_mb']:7.1f} MB" if result["peak_rss_mb"] is not None else "    n/a"
+    print(f"concurrency {result['concurrency']:>3}: {result['sessions_per_s']:7.2f} sessions/s  {result['reruns_per_s']:7.2f} reruns/s"
+          f"  p50 {latency.get('p50_ms', 0):8.1f} ms  p95 {latency.get('p95_ms', 0):8.1f} ms  p99 {latency.get('p99_ms', 0):8.1f} ms"
+          f"  cpu {cpu}  rss {rss}  llm {result['llm_requests']:4d}  errors {result['errors']}", file=sys.stderr)
+    for name, steps in result["steps"].items():
+        print(f"    {name:<10} n {steps['count']:5d}  p50 {steps['p50_ms']:8.1f} ms  p95 {steps['p95_ms']:8.1f} ms"
+              f"  p99 {steps['p99_ms']:8.1f} ms", file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test the Streamlit app with concurrent simulated sessions.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16], help="concurrent sessions per level")
+    parser.add_argument("--sessions", type=int, help="sessions per level (default: 2 x concurrency)")
+    parser.add_argument("--queries-per-session", type=int, default=3, help="typed queries per session")
+    parser.add_argument("--query-pool", type=int, default=50, help="distinct queries; popularity follows a Zipf-like curve")
+    parser.add_argument("--rows", type=int, default=20000, help="rows in the synthetic knowledge base")
+    parser.add_argument("--llm-latency", type=float, default=0.8, help="seconds before the fake LLM responds")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="seconds between streamed words")
+    parser.add_argument("--llm-rate-limit", type=float, default=50, help="LLM_RATE_LIMIT for the app (requests per second)")
+    parser.add_argument("--s3-latency", type=float, default=0.0, help="seconds added to each S3 request")
+    parser.add_argument("--no-stream", dest="stream", action="store_false", help="wait for full answers (STREAM_RESPONSES=0)")
+    parser.add_argument("--no-tickets", dest="tickets", action="store_false", help="skip the ticket step")
+    parser.add_argument("--port", type=int, default=8765, help="port for the app under test")
+    parser.add_argument("--timeout", type=float, default=120, help="seconds a single rerun may take")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write results JSON here")
+    args = parser.parse_args(argv)
+    if websockets is None:
+        parser.error("the load test needs the websockets package (not in requirements.txt): pip install websockets")
+
+    s3_server = FakeS3Server(latency=args.s3_latency).start()
+    s3_server.put_object(Bucket=BUCKET, Key=KEY, Body=to_csv_bytes(generate_corpus(args.rows, seed=args.seed)))
+    llm_server = FakeOpenAIServer(latency=args.llm_latency, token_delay=args.token_delay).start()
+    queries = generate_queries(args.query_pool, seed=args.seed)
+    weights = [1 / (rank + 1) for rank in range(len(queries))]
+    url = f"ws://127.0.0.1:{args.port}/_stcore/stream"
+
+    report = {
+        "meta": {"python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count(),
+                 "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "rows": args.rows, "llm_latency": args.llm_latency,
+                 "token_delay": args.token_delay, "stream": args.stream, "queries_per_session": args.queries_per_session},
+        "levels": [],
+    }
+    with tempfile.TemporaryDirectory() as workdir:
+        log_path = os.path.join(workdir, "streamlit.log")
+        app = start_app(app_environment(workdir, s3_server.url, llm_server.url, args), args.port, log_path)
+        try:
+            report["warmup_seconds"] = round(asyncio.run(warm_up(url, args)), 3)
+            print(f"app ready after {report['warmup_seconds']:.2f} s (pid {app.pid})", file=sys.stderr)
+            for concurrency in args.concurrency:
+                result = asyncio.run(run_level(concurrency, args.sessions or 2 * concurrency, url, app.pid,
+                                               queries, weights, args, llm_server))
+                print_level(result)
+                report["levels"].append(result)
+        finally:
+            app.terminate()
+            try:
+                app.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                app.kill()
+            if app.returncode not in (0, -15):
+                with open(log_path, encoding="utf-8", errors="replace") as f:
+                    print(f.read()[-4000:], file=sys.stderr)
+
+    report["s3_calls"] = s3_server.calls
+    s3_server.stop()
+    llm_server.stop()
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return 1 if any(level["errors"] for level in report["levels"]) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
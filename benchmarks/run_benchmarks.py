@@ -0,0 +1,204 @@
+"""Latency, throughput and memory benchmarks for the chat pipeline.
+
+Usage (from the repository root):
+    python -m benchmarks.run_benchmarks --sizes 1000 10000 100000
+    python -m benchmarks.run_benchmarks --sizes 1000000 --skip fuzzy_build
+    python -m benchmarks.run_benchmarks --save-baseline benchmarks/baseline.json
+    python -m benchmarks.run_benchmarks --compare benchmarks/baseline.json --tolerance 0.25
+
+S3 and the LLM are replaced with in-process stubs, so results measure this
+code only (plus --llm-latency seconds per simulated LLM call). Each stage
+reports p50/p95/p99 latency in milliseconds, throughput in operations per
+second, and with --memory the peak traced memory in MB of one extra cold run
+(fresh caches, so loads and builds are not served from disk; tracemalloc slows
+Python down several times, so it is never timed).
+"""
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import tracemalloc
+import numpy as np
+import llm
+from kb_loader import KnowledgeBaseLoader
+from knowledge_base import KnowledgeBase
+from retrieval import build_search_index, build_fuzzy_matcher
+from semantic import load_or_build_embedding_index
+from dedupe import RowDeduplicator
+from faq import FAQCache, build_faq_questions, group_similar_subjects
+from prompt_builder import PromptBuilder
+from categorizer import determine_sub_category
+from answer_cache import AnswerCache
+from engine import ChatEngine
+from benchmarks.synthetic import generate_corpus, generate_queries, to_csv_bytes
+from benchmarks.stubs import StubS3, stub_llm_client
+
+BUCKET = "benchmark-bucket"
+KEY = "Good_copy_fixed_anonymised_data.csv"
+STAGES = [
+    "load", "revalidate", "kb_build", "dedupe", "bm25_build", "bm25_query", "fuzzy_build", "fuzzy_query",
+    "semantic_build", "semantic_query", "faq_grouping", "faq_build", "prompt_assembly", "categorize", "end_to_end",
+]
+
+
+# Function to summarise a list of per-operation latencies (seconds)
+def summarize(latencies, peak_bytes=None):
+    values = np.asarray(latencies, dtype=float) * 1000
+    total = values.sum() / 1000
+    result = {
+        "count": len(values),
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "p99_ms": float(np.percentile(values, 99)),
+        "throughput_per_s": float(len(values) / total) if total else None,
+    }
+    if peak_bytes is not None:
+        result["peak_mb"] = peak_bytes / 2 ** 20
+    return result
+
+
+# Function to time fn(item) for every item, then optionally trace the peak memory of one more
+# call, or of cold() for stages whose repeat calls would be served from a cache
+def measure(fn, items, trace_memory=False, cold=None):
+    latencies = []
+    result = None
+    for item in items:
+        started = time.perf_counter()
+        result = fn(item)
+        latencies.append(time.perf_counter() - started)
+    peak = None
+    if trace_memory:
+        tracemalloc.start()
+        cold() if cold else fn(item)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result, summarize(latencies, peak)
+
+
+def run_size(rows, args, workdir):
+    corpus = generate_corpus(rows, seed=rows)
+    queries = generate_queries(args.queries)
+    s3 = StubS3()
+    s3.put_object(Bucket=BUCKET, Key=KEY, Body=to_csv_bytes(corpus))
+    del corpus
+    llm.set_llm_client(stub_llm_client(latency=args.llm_latency))
+
+    results = {}
+    skip = set(args.skip)
+
+    def stage(name, fn, items=(None,), trace_memory=True, cold=None):
+        if name in skip:
+            return None
+        value, results[name] = measure(fn, items, trace_memory and args.memory, cold)
+        print(f"  {name:<16} p50 {results[name]['p50_ms']:10.3f} ms  p95 {results[name]['p95_ms']:10.3f} ms"
+              + (f"  peak {results[name]['peak_mb']:8.1f} MB" if "peak_mb" in results[name] else ""), file=sys.stderr)
+        return value
+
+    snapshot_dir = os.path.join(workdir, f"snapshots-{rows}")
+    loader = KnowledgeBaseLoader(s3, BUCKET, KEY, refresh_interval=0, snapshot_dir=snapshot_dir)
+    data = stage("load", lambda _: loader.get(),
+                 cold=lambda: KnowledgeBaseLoader(s3, BUCKET, KEY, snapshot_dir=tempfile.mkdtemp(dir=workdir)).get())
+    if data is None:
+        data = loader.get()
+    stage("revalidate", lambda _: loader.get(), range(20), trace_memory=False)
+    kb = stage("kb_build", lambda _: KnowledgeBase(data, loader.version)) or KnowledgeBase(data, loader.version)
+
+    def deduplicate(_):
+        dedupe = RowDeduplicator()
+        dedupe.add_rows(kb)
+        return dedupe
+
+    dedupe = stage("dedupe", deduplicate)
+    if dedupe is not None:
+        print(f"  {'':<16} {dedupe.report()}", file=sys.stderr)
+
+    index = stage("bm25_build", lambda _: build_search_index(kb))
+    if index is not None:
+        stage("bm25_query", lambda q: index.search(q, k=10), queries, trace_memory=False)
+
+    matcher = stage("fuzzy_build", lambda _: build_fuzzy_matcher(kb))
+    if matcher is not None:
+        stage("fuzzy_query", lambda q: matcher.search(q, k=10), queries[:max(1, len(queries) // 4)], trace_memory=False)
+
+    if args.semantic:
+        semantic_index = stage("semantic_build", lambda _: load_or_build_embedding_index(kb, loader.version, cache_dir=os.path.join(workdir, f"emb-{rows}")),
+                               cold=lambda: load_or_build_embedding_index(kb, loader.version, cache_dir=tempfile.mkdtemp(dir=workdir)))
+        if semantic_index is not None:
+            stage("semantic_query", lambda q: semantic_index.search(q, k=10), queries, trace_memory=False)
+
+    subjects = kb.value_counts("Subject").nlargest(args.faq_subjects).index.tolist()
+    stage("faq_grouping", lambda _: group_similar_subjects(subjects))
+    generate = lambda terms: llm.batch_chat_completions([[{"role": "user", "content": t}] for t in terms])
+    stage("faq_build", lambda _: build_faq_questions(kb, loader.version, generate, cache=FAQCache(os.path.join(workdir, f"faq-{rows}.json"))),
+          cold=lambda: build_faq_questions(kb, loader.version, generate, cache=FAQCache(os.path.join(tempfile.mkdtemp(dir=workdir), "faq.json"))))
+
+    builder = PromptBuilder()
+    replies = [kb.replies(row) for row in range(min(10, len(kb)))]
+    messages = [{"role": "user", "content": q} for q in queries[:5]]
+    stage("prompt_assembly", lambda q: builder.build(q, replies, messages), queries, trace_memory=False)
+    stage("categorize", lambda q: determine_sub_category(q), queries, trace_memory=False)
+
+    engine = ChatEngine(s3=s3, bucket_name=BUCKET, file_key=KEY,
+                        answer_cache=AnswerCache(os.path.join(workdir, f"answers-{rows}.sqlite3")))
+    engine.loader = loader
+    engine.current()
+    stage("end_to_end", lambda q: engine.answer(q, [{"role": "user", "content": q}]).text,
+          [f"{q} #{i}" for i, q in enumerate(queries[:args.end_to_end])], trace_memory=False)
+    return results
+
+
+# Function to list stages whose p95 latency regressed beyond the tolerance
+def find_regressions(results, baseline, tolerance):
+    regressions = []
+    for size, stages in results.items():
+        for name, current in stages.items():
+            previous = baseline.get("results", {}).get(size, {}).get(name)
+            if previous and previous["p95_ms"] > 0 and current["p95_ms"] > previous["p95_ms"] * (1 + tolerance):
+                regressions.append(f"{size} rows / {name}: p95 {previous['p95_ms']:.3f} -> {current['p95_ms']:.3f} ms")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark load, retrieval, FAQ build and prompt assembly on synthetic data.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="corpus sizes in rows")
+    parser.add_argument("--queries", type=int, default=200, help="queries per retrieval stage")
+    parser.add_argument("--end-to-end", type=int, default=50, help="queries for the end-to-end stage")
+    parser.add_argument("--faq-subjects", type=int, default=200, help="subjects passed to group_similar_subjects")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="seconds added to each stubbed LLM call")
+    parser.add_argument("--semantic", action="store_true", help="also benchmark the embedding index")
+    parser.add_argument("--memory", action="store_true", help="also report peak traced memory of the build stages")
+    parser.add_argument("--skip", nargs="*", default=[], choices=STAGES, help="stages to skip")
+    parser.add_argument("--output", help="write results JSON here")
+    parser.add_argument("--save-baseline", help="write results JSON as the new baseline")
+    parser.add_argument("--compare", help="baseline JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed p95 slowdown vs baseline (0.25 = 25%%)")
+    args = parser.parse_args(argv)
+
+    report = {
+        "meta": {"python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count(),
+                 "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "llm_latency": args.llm_latency},
+        "results": {},
+    }
+    with tempfile.TemporaryDirectory() as workdir:
+        for rows in args.sizes:
+            print(f"{rows} rows", file=sys.stderr)
+            report["results"][str(rows)] = run_size(rows, args, workdir)
+
+    for path in filter(None, [args.output, args.save_baseline]):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = find_regressions(report["results"], json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
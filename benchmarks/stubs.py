@@ -0,0 +1,65 @@
+import io
+import time
+import hashlib
+import datetime
+import threading
+from llm import LLMClient, FakeStreamingClient, TokenBucket
+
+
+# In-memory stand-in for the boto3 S3 client calls the app makes
+class StubS3:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.objects = {}
+        self.calls = {}
+        self._lock = threading.Lock()
+
+    def _count(self, operation):
+        with self._lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def put_object(self, Bucket, Key, Body):
+        body = Body if isinstance(Body, bytes) else Body.encode('utf-8')
+        self.objects[(Bucket, Key)] = {
+            "Body": body,
+            "ETag": '"' + hashlib.md5(body).hexdigest() + '"',
+            "LastModified": datetime.datetime.now(datetime.timezone.utc),
+        }
+
+    def _get(self, Bucket, Key):
+        try:
+            return self.objects[(Bucket, Key)]
+        except KeyError:
+            raise KeyError(f"NoSuchKey: s3://{Bucket}/{Key}")
+
+    def head_object(self, Bucket, Key):
+        self._count("head_object")
+        obj = self._get(Bucket, Key)
+        return {"ETag": obj["ETag"], "LastModified": obj["LastModified"], "ContentLength": len(obj["Body"])}
+
+    def get_object(self, Bucket, Key, Range=None, IfMatch=None):
+        self._count("get_object")
+        obj = self._get(Bucket, Key)
+        if IfMatch is not None and IfMatch != obj["ETag"]:
+            raise ValueError(f"PreconditionFailed: s3://{Bucket}/{Key} no longer matches {IfMatch}")
+        body = obj["Body"]
+        if Range:
+            start, end = Range.replace("bytes=", "").split("-")
+            body = body[int(start):int(end) + 1]
+        return {"Body": io.BytesIO(body), "ETag": obj["ETag"], "LastModified": obj["LastModified"], "ContentLength": len(body)}
+
+    def list_objects_v2(self, Bucket, Prefix="", **kwargs):
+        self._count("list_objects_v2")
+        contents = [
+            {"Key": key, "ETag": obj["ETag"], "LastModified": obj["LastModified"], "Size": len(obj["Body"])}
+            for (bucket, key), obj in sorted(self.objects.items())
+            if bucket == Bucket and key.startswith(Prefix)
+        ]
+        return {"Contents": contents, "KeyCount": len(contents), "IsTruncated": False}
+
+
+# Function to build an LLM client backed by the local fake, with no rate limit or retries
+def stub_llm_client(latency=0.0, token_delay=0.0):
+    return LLMClient(FakeStreamingClient(latency=latency, token_delay=token_delay), max_retries=0, rate_limiter=TokenBucket(0, 0))
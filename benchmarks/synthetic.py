@@ -0,0 +1,89 @@
+import io
+import random
+import datetime
+import pandas as pd
+
+MODULES = [
+    "Agency Health Check", "CIO Dashboard", "AIISA", "IM8 Process Audit", "VAPT Findings", "CageScan",
+    "CISO Reporting", "Digital Service", "ICT Governance", "MF Dashboards", "ICT Plan and Spend", "PSIRC",
+    "Integrated Risk Management", "Supplier Management", "System Management", "Policy Waiver",
+]
+ACTIONS = [
+    "unable to update", "cannot submit", "error when saving", "how do I edit", "missing records in",
+    "access denied for", "cannot login to", "slow performance on", "need to delete", "wrong data shown in",
+    "how to export", "unable to approve", "workflow stuck in", "request for access to", "clarification on",
+]
+OBJECTS = [
+    "system record", "risk register", "supplier profile", "dashboard", "annual fee", "subscription",
+    "system criticality assessment", "risk materiality", "findings", "waiver request", "user account",
+    "agency profile", "digital service record", "plan submission", "audit report",
+]
+REPLY_TEMPLATES = [
+    "Please refer to the user guide on the DGP portal for the steps to {action} the {obj}.",
+    "The {module} module is locked for updates during the ongoing exercise. Please try again after the exercise ends.",
+    "We have reset your access to {module}. Please log out and log in again.",
+    "Kindly approach your agency administrator to grant you the {module} role.",
+    "The issue with the {obj} has been fixed. Please refresh the page.",
+    "Thank you for your feedback. We will look into it and get back to you.",
+]
+COMMENTS = [
+    "", "", "Resolved by the operations team.", "Escalated to the product team.",
+    "Closed after user confirmation.", "Duplicate of an earlier ticket.",
+]
+
+
+# Function to generate a synthetic knowledge base following the CSV schema
+# ("Details of Query", "Subject", "Reply", "Additional Comments").
+# A small share of subjects dominate, like real ticket demand.
+def generate_corpus(rows, seed=0):
+    rng = random.Random(seed)
+    weights = [1.0 / (rank + 1) for rank in range(len(MODULES) * len(OBJECTS))]
+    topics = [(module, obj) for module in MODULES for obj in OBJECTS]
+
+    records = {"Details of Query": [], "Subject": [], "Reply": [], "Additional Comments": []}
+    for i in range(rows):
+        module, obj = rng.choices(topics, weights)[0]
+        action = rng.choice(ACTIONS)
+        records["Subject"].append(f"{module} - {action} {obj}")
+        records["Details of Query"].append(
+            f"Hi team, I am {action} the {obj} in the {module} module. "
+            f"Reference {rng.randint(1000, 99999)}. Please advise on the next steps."
+        )
+        records["Reply"].append(rng.choice(REPLY_TEMPLATES).format(action=action.split()[-1], obj=obj, module=module))
+        records["Additional Comments"].append(rng.choice(COMMENTS))
+    return pd.DataFrame(records)
+
+
+# Function to generate ITSM ticket exports following the user_log.csv schema
+def generate_tickets(rows, seed=0):
+    rng = random.Random(seed)
+    start = datetime.datetime(2023, 1, 1)
+    corpus = generate_corpus(rows, seed)
+    return pd.DataFrame({
+        "Sub Category": [""] * rows,
+        "Number": [f"INC{i:08d}" for i in range(rows)],
+        "Subject": corpus["Subject"],
+        "Opened Date/Time": [(start + datetime.timedelta(minutes=rng.randint(0, 525600))).strftime("%Y-%m-%d %H:%M:%S") for _ in range(rows)],
+        "Category": ["DGP"] * rows,
+        "Details of Query": corpus["Details of Query"],
+    })
+
+
+# Function to generate user queries: paraphrased fragments of real subjects, with occasional typos
+def generate_queries(count, seed=1):
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        query = f"{rng.choice(ACTIONS)} {rng.choice(OBJECTS)} {rng.choice(MODULES)}".lower()
+        if rng.random() < 0.3:
+            position = rng.randrange(len(query))
+            query = query[:position] + query[position + 1:]
+        queries.append(query)
+    return queries
+
+
+# Function to encode a frame as CSV bytes the way the ITSM exports are stored (cp1252)
+def to_csv_bytes(frame):
+    buffer = io.StringIO()
+    frame.to_csv(buffer, index=False)
+    return buffer.getvalue().encode('cp1252', errors='replace')
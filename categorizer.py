@@ -0,0 +1,86 @@
+import re
+from collections import defaultdict
+
+# Define keywords for each sub-category
+sub_category_keywords = {
+    "Advisories, Briefings and any other business matters": ["advisory", "briefing", "business matters", "billing", "annual fee", "subscription"],
+    "Application Access & Performance (including Migration to GCC+)": ["login", "access", "performance", "GCC"],
+    "Data / UI & Process/Workflow of Agency & System Management Modules": ["process", "workflow", "agency", "system", "system criticality", "sca", "risk materiality", "sml"],
+    "Data / UI Agency Health Check": ["health check", "cio reporting", "cio dashboard"],
+    "Data / UI of AIISA, IM8 Process Audit, IM8 VAPT Findings, UC & Internal Audit Modules": ["AIISA", "process audit", "VAPT", "findings", "internal audit"],
+    "Data / UI of CageScan Module": ["CageScan"],
+    "Data / UI of CISO Reporting Module": ["CISO"],
+    "Data / UI of Digital Service Module": ["digital service"],
+    "Data / UI of ICT Governance Module & MF Dashboards": ["ICT governance", "MF dashboards", "mf", "ministry family"],
+    "Data / UI of ICT Plan and Spend & PSIRC Module": ["plan", "spend", "PSIRC"],
+    "Data / UI of Integrated Risk Management Module": ["risk management", "IRM", "risk", "ra"],
+    "Data / UI of Policy, Standards and Guidelines": ["policy", "standards", "guidelines", "waiver"],
+    "Data / UI of Supplier Management Module": ["supplier management", "supplier", "vendor"],
+}
+
+
+# Compiled keyword classifier for ticket sub-categories.
+# All keywords are folded into one case-insensitive regex, so a text is
+# scanned once no matter how many keywords there are. Keywords only match
+# whole words (optionally pluralised), so "ra" no longer fires inside
+# "grant", and longer keywords win over their prefixes ("risk management"
+# before "risk"). Each hit scores its category by the keyword's word count.
+class SubCategoryClassifier:
+    def __init__(self, keywords_by_category=sub_category_keywords):
+        self.order = {category: i for i, category in enumerate(keywords_by_category)}
+        self.categories_by_keyword = defaultdict(list)
+        for category, keywords in keywords_by_category.items():
+            for keyword in keywords:
+                self.categories_by_keyword[keyword.lower()].append(category)
+
+        alternatives = sorted(self.categories_by_keyword, key=len, reverse=True)
+        self.pattern = re.compile(
+            r"(?<![a-z0-9])(" + "|".join(re.escape(keyword) for keyword in alternatives) + r")(?:e?s)?(?![a-z0-9])",
+            re.IGNORECASE,
+        )
+
+    # Scored categories for a text, best first; ties keep the keyword table's order
+    def classify(self, text):
+        scores = defaultdict(float)
+        for match in self.pattern.finditer(text or ""):
+            keyword = match.group(1).lower()
+            for category in self.categories_by_keyword[keyword]:
+                scores[category] += len(keyword.split())
+        return sorted(scores.items(), key=lambda item: (-item[1], self.order[item[0]]))
+
+    def best(self, text, default="Uncategorized"):
+        scored = self.classify(text)
+        return scored[0][0] if scored else default
+
+    def classify_many(self, texts, default="Uncategorized"):
+        return [self.best(text, default) for text in texts]
+
+
+classifier = SubCategoryClassifier()
+
+
+# Function to determine sub-category, falling back to the FAQ term when the query has no keyword hits
+def determine_sub_category(user_query, faq_term=None):
+    scored = classifier.classify(user_query)
+    if not scored and faq_term:
+        scored = classifier.classify(faq_term)
+    return scored[0][0] if scored else "Uncategorized"
+
+
+### Function to summarize user input into a subject
+def summarize_user_input(input_query):
+    # Remove extra whitespace
+    input_query = input_query.strip()
+    
+    # If the input is empty, return a placeholder
+    if not input_query:
+        return "No subject provided"
+    
+    # Split into sentences
+    sentences = re.split(r'(?<=[.!?]) +', input_query)
+    
+    # Take the first sentence and limit to a max length
+    first_sentence = sentences[0] if sentences else input_query
+    summarized_subject = first_sentence[:50] + "..." if len(first_sentence) > 50 else first_sentence
+    
+    return summarized_subject.strip()
@@ -0,0 +1,159 @@
+import zlib
+import threading
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+import numpy as np
+from retrieval import TOKEN_PATTERN, trigrams
+
+# Prime just above 2**32; with 32-bit shingle hashes and a < 2**31 the
+# permutation a * x + b stays inside uint64 without overflowing
+MINHASH_PRIME = np.uint64(4294967311)
+
+
+# Function to normalise a subject so trivially different spellings count as one
+def normalize_subject(subject):
+    return " ".join(TOKEN_PATTERN.findall(str(subject).lower()))
+
+
+# MinHash signatures over character trigrams, computed for all permutations at once
+class MinHasher:
+    def __init__(self, num_perm=64, seed=1):
+        rng = np.random.RandomState(seed)
+        self.num_perm = num_perm
+        self.a = rng.randint(1, 2 ** 31, size=num_perm).astype(np.uint64)
+        self.b = rng.randint(0, 2 ** 32, size=num_perm, dtype=np.int64).astype(np.uint64)
+
+    def signature(self, text):
+        shingles = trigrams(text)
+        if not shingles:
+            return np.full(self.num_perm, np.iinfo(np.uint64).max, dtype=np.uint64)
+        hashes = np.fromiter((zlib.crc32(s.encode('utf-8')) for s in shingles), dtype=np.uint64, count=len(shingles))
+        return ((self.a[:, None] * hashes[None, :] + self.b[:, None]) % MINHASH_PRIME).min(axis=1)
+
+    # Signatures of many texts at once, given the 32-bit hashes of all their shingles
+    # concatenated and the number belonging to each text (repeats do not change a minimum).
+    # Permutes about `block` hashes at a time to bound the temporary matrix.
+    def signatures_from_hashes(self, hashes, lengths, block=50000):
+        signatures = np.full((len(lengths), self.num_perm), np.iinfo(np.uint64).max, dtype=np.uint64)
+        ends = np.cumsum(lengths)
+        starts = ends - lengths
+        first = 0
+        while first < len(lengths):
+            last = max(first + 1, int(np.searchsorted(ends, starts[first] + block, side='right')))
+            filled = first + np.flatnonzero(lengths[first:last])
+            if len(filled):
+                chunk = hashes[starts[first]:ends[last - 1]]
+                values = (self.a[:, None] * chunk[None, :] + self.b[:, None]) % MINHASH_PRIME
+                signatures[filled] = np.minimum.reduceat(values, starts[filled] - starts[first], axis=1).T
+            first = last
+        return signatures
+
+
+@dataclass
+class Cluster:
+    label: str
+    count: int = 0
+    members: Counter = field(default_factory=Counter)
+
+    @property
+    def size(self):
+        return len(self.members)
+
+
+# Incremental clustering of ticket subjects weighted by demand.
+# Each new subject is blocked with MinHash LSH (bands x rows = num_perm) so it is
+# only scored against clusters sharing a band; the best few candidates by estimated
+# Jaccard are verified with the same fuzzy scorer and threshold as before, against
+# the subject that founded each cluster. A cluster's label is its most requested
+# member (the first seen on ties).
+class SubjectClusterer:
+    def __init__(self, threshold=80, num_perm=64, bands=32, max_candidates=10, min_jaccard=0.15, scorer=None):
+        if scorer is None:
+            from fuzzywuzzy import fuzz
+            scorer = fuzz.WRatio
+        self.threshold = threshold
+        self.hasher = MinHasher(num_perm)
+        self.bands = bands
+        self.rows_per_band = num_perm // bands
+        self.max_candidates = max_candidates
+        self.min_jaccard = min_jaccard
+        self.scorer = scorer
+        self.reset()
+        self._lock = threading.Lock()
+
+    def reset(self):
+        self.clusters = []
+        self.signatures = []
+        self.normalized_labels = []  # normalised text each cluster was founded with
+        self.buckets = defaultdict(list)
+        self.assignments = {}  # normalised subject -> cluster id
+        self.seen = Counter()  # raw subject -> count already added
+
+    def _band_keys(self, signature):
+        step = self.rows_per_band
+        return [(band, signature[band * step:(band + 1) * step].tobytes()) for band in range(self.bands)]
+
+    def _find_cluster(self, normalized, signature, band_keys):
+        candidates = {cluster_id for key in band_keys for cluster_id in self.buckets.get(key, ())}
+        if not candidates:
+            return None
+        candidates = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+        similarity = (np.stack([self.signatures[c] for c in candidates]) == signature).mean(axis=1)
+        order = np.argsort(-similarity)[:self.max_candidates]
+
+        # Most similar first, so the first cluster over the threshold is taken
+        for i in order:
+            if similarity[i] < self.min_jaccard:
+                break
+            cluster_id = int(candidates[i])
+            if self.scorer(normalized, self.normalized_labels[cluster_id]) >= self.threshold:
+                return cluster_id
+        return None
+
+    def add(self, subject, count=1):
+        with self._lock:
+            self._add(subject, count)
+
+    def _add(self, subject, count):
+        self.seen[subject] += count
+        normalized = normalize_subject(subject)
+        cluster_id = self.assignments.get(normalized)
+        if cluster_id is None:
+            signature = self.hasher.signature(normalized)
+            band_keys = self._band_keys(signature)
+            cluster_id = self._find_cluster(normalized, signature, band_keys)
+            if cluster_id is None:
+                cluster_id = len(self.clusters)
+                self.clusters.append(Cluster(label=subject))
+                self.signatures.append(signature)
+                self.normalized_labels.append(normalized)
+                for key in band_keys:
+                    self.buckets[key].append(cluster_id)
+            self.assignments[normalized] = cluster_id
+
+        cluster = self.clusters[cluster_id]
+        cluster.count += count
+        cluster.members[subject] += count
+        if cluster.members[subject] > cluster.members[cluster.label]:
+            cluster.label = subject
+
+    # Bring the clusters in line with a full subject -> count table, adding only the
+    # increase since the last call. Counts never shrink as tickets are appended; if
+    # they do (the history was replaced), the clusters are rebuilt.
+    def update(self, counts):
+        with self._lock:
+            counts = {subject: int(count) for subject, count in counts.items() if count > 0}
+            if any(counts.get(subject, 0) < seen for subject, seen in self.seen.items()):
+                self.reset()
+            added = 0
+            for subject, count in counts.items():
+                delta = count - self.seen.get(subject, 0)
+                if delta > 0:
+                    self._add(subject, delta)
+                    added += 1
+            return added
+
+    # The n most requested clusters
+    def top(self, n):
+        with self._lock:
+            return sorted(self.clusters, key=lambda cluster: cluster.count, reverse=True)[:n]
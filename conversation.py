@@ -0,0 +1,115 @@
+import os
+import re
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+
+CONVERSATION_WINDOW = int(os.getenv("CONVERSATION_WINDOW", "20"))  # messages kept verbatim
+CONVERSATION_SUMMARY_LINES = int(os.getenv("CONVERSATION_SUMMARY_LINES", "30"))  # compacted older messages kept
+SUMMARY_LINE_CHARS = 160
+USER_QUERY_HEAD_CHARS = 200  # enough of the joined user messages to derive a ticket subject
+GREETING = "Hello there! Please enter your query or click on any of the Frequently Asked Questions to continue."
+
+
+# Function to get the messages of a new conversation once its first question is asked
+def opening_messages(question):
+    return [{"role": "assistant", "content": GREETING}, {"role": "user", "content": question}]
+
+
+# Function to compact a message to one line: its first sentence, capped in length
+def compact_message(msg, max_chars=SUMMARY_LINE_CHARS):
+    content = " ".join(str(msg["content"]).split())
+    first_sentence = re.split(r'(?<=[.!?]) +', content)[0]
+    if len(first_sentence) > max_chars:
+        first_sentence = first_sentence[:max_chars - 3].rstrip() + "..."
+    return f"{msg['role'].capitalize()}: {first_sentence}"
+
+
+# What a logged ticket needs from a conversation, with its size bounded like the conversation
+@dataclass
+class Transcript:
+    summary: str = ""
+    messages: list = field(default_factory=list)
+    user_query_head: str = ""
+    total_messages: int = 0
+
+    # The "Details of Query" text: the compacted summary of older turns, then the recent turns in full
+    def details(self):
+        lines = []
+        if self.summary:
+            lines.append("- Earlier messages (summarised):")
+            lines.extend(f"  {line}" for line in self.summary.splitlines())
+        lines.extend(f"- {msg['role'].capitalize()}: {msg['content']}" for msg in self.messages)
+        return "\n".join(lines)
+
+    # Messages to store with the ticket, the summary first as its own entry
+    def to_messages(self):
+        messages = list(self.messages)
+        if self.summary:
+            messages.insert(0, {"role": "summary", "content": self.summary})
+        return messages
+
+
+# Chat history for one session with bounded memory. The last `window` messages are kept
+# verbatim; older ones are compacted into one summary line each, and only the latest
+# `summary_lines` of those are kept (the rest are only counted). Supports the list
+# operations the page uses: append, len, iteration and indexing over the recent window.
+# Each conversation has its own id, so a new chat is never mistaken for an earlier one.
+class Conversation:
+    def __init__(self, messages=(), window=CONVERSATION_WINDOW, summary_lines=CONVERSATION_SUMMARY_LINES):
+        self.id = uuid.uuid4().hex
+        self.window = max(4, window)
+        self.recent = deque()
+        self.summary = deque(maxlen=summary_lines)
+        self.compacted = 0
+        self.total = 0
+        self.user_query_head = ""
+        for msg in messages:
+            self.append(msg)
+
+    def append(self, msg):
+        if msg["role"] == "user" and len(self.user_query_head) < USER_QUERY_HEAD_CHARS:
+            head = f"{self.user_query_head}\n{msg['content']}" if self.user_query_head else msg["content"]
+            self.user_query_head = head[:USER_QUERY_HEAD_CHARS]
+        self.recent.append(msg)
+        self.total += 1
+        while len(self.recent) > self.window:
+            self.summary.append(compact_message(self.recent.popleft()))
+            self.compacted += 1
+
+    def __len__(self):
+        return self.total
+
+    def __iter__(self):
+        return iter(self.recent)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(self.recent)[index]
+        return self.recent[index]
+
+    # Compacted messages that no longer fit in the summary either
+    @property
+    def omitted(self):
+        return self.compacted - len(self.summary)
+
+    def summary_text(self):
+        lines = list(self.summary)
+        if self.omitted:
+            lines.insert(0, f"({self.omitted} earlier messages omitted)")
+        return "\n".join(lines)
+
+    # The last `limit` messages to draw, and how many recent messages are hidden before them
+    def visible(self, limit):
+        hidden = max(0, len(self.recent) - limit)
+        return list(self.recent)[hidden:], hidden
+
+    # Messages for prompt assembly: the summary of older turns as one message, then the window
+    def for_prompt(self):
+        messages = list(self.recent)
+        if self.summary:
+            messages.insert(0, {"role": "summary", "content": self.summary_text()})
+        return messages
+
+    def transcript(self):
+        return Transcript(self.summary_text() if self.summary else "", list(self.recent), self.user_query_head, self.total)
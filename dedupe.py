@@ -0,0 +1,152 @@
+import os
+import zlib
+from collections import defaultdict
+import numpy as np
+from clustering import MinHasher
+from knowledge_base import TEXT_COLUMNS
+from retrieval import TOKEN_PATTERN
+
+# Estimated Jaccard similarity (word pairs over the whole row) at or above
+# which two rows are collapsed into one canonical entry; 0 disables near-duplicate matching
+KB_DEDUPE_THRESHOLD = float(os.getenv("KB_DEDUPE_THRESHOLD", "0.9"))
+# Rough size of one BM25 posting, a (doc, tf) tuple plus its list slot, for the savings report
+POSTING_BYTES = 72
+
+
+# Function to hash the adjacent word pairs of each text (a lone word stands for itself),
+# returning all hashes concatenated and the count per text. Rows are a few sentences, so
+# word pairs are cheaper than character trigrams and more selective. Each distinct word
+# is hashed once; pairs are combined from the word hashes with numpy.
+def word_pair_hashes(texts):
+    vocabulary = {}
+
+    def word_hash(token):
+        value = vocabulary.get(token)
+        if value is None:
+            value = vocabulary[token] = zlib.crc32(token.encode('utf-8'))
+        return value
+
+    token_lists = [TOKEN_PATTERN.findall(text.lower()) for text in texts]
+    token_counts = np.fromiter(map(len, token_lists), dtype=np.int64, count=len(token_lists))
+    words = np.fromiter((word_hash(token) for tokens in token_lists for token in tokens),
+                        dtype=np.uint64, count=int(token_counts.sum()))
+    pairs = (words[:-1] * np.uint64(0x9E3779B1) + words[1:]) & np.uint64(0xFFFFFFFF)
+
+    # Position i starts a shingle unless it is the last word of its text; single-word texts keep their word
+    last_word = np.cumsum(token_counts)[token_counts > 0] - 1
+    keep = np.ones(len(words), dtype=bool)
+    keep[last_word] = False
+    single = last_word[token_counts[token_counts > 0] == 1]
+    keep[single] = True
+    hashes = np.append(pairs, np.uint64(0)) if len(words) else words
+    hashes[single] = words[single]
+    return hashes[keep], np.maximum(token_counts - 1, np.minimum(token_counts, 1))
+
+
+# Collapses duplicate knowledge-base rows into canonical rows with frequency counts, so
+# the retrieval indexes only hold one entry per distinct question/answer. Rows with
+# identical cells are matched on their category codes; the remaining distinct rows are
+# blocked with MinHash LSH and matched on estimated Jaccard similarity. 8 bands of 8
+# rows put the LSH cut-off near 0.77, just under the default threshold, so few
+# candidates are compared. Rows only ever map to an earlier canonical row, so the
+# mapping can be extended as rows are appended.
+class RowDeduplicator:
+    def __init__(self, threshold=KB_DEDUPE_THRESHOLD, num_perm=64, bands=8):
+        self.threshold = threshold
+        self.hasher = MinHasher(num_perm)
+        self.bands = bands
+        self.rows_per_band = num_perm // bands
+        self.exact = {}  # tuple of category codes -> canonical row
+        self.canonical_rows = []
+        self.signatures = np.empty((0, num_perm), dtype=np.uint64)  # per canonical row, grown by doubling
+        self.buckets = defaultdict(list)  # LSH band -> positions in canonical_rows
+        self.row_to_canonical = []
+        self.counts = defaultdict(int)  # canonical row -> rows it stands for
+        self.exact_duplicates = 0
+        self.near_duplicates = 0
+
+    def _band_keys(self, signature):
+        step = self.rows_per_band
+        return [(band, signature[band * step:(band + 1) * step].tobytes()) for band in range(self.bands)]
+
+    def _match(self, signature, band_keys):
+        candidates = {position for key in band_keys for position in self.buckets.get(key, ())}
+        if not candidates:
+            return None
+        candidates = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+        similarity = (self.signatures[candidates] == signature).mean(axis=1)
+        best = int(np.argmax(similarity))
+        return self.canonical_rows[candidates[best]] if similarity[best] >= self.threshold else None
+
+    def _store(self, signature, band_keys):
+        position = len(self.canonical_rows)
+        if position == len(self.signatures):
+            grown = np.empty((max(1024, 2 * position), self.signatures.shape[1]), dtype=np.uint64)
+            grown[:position] = self.signatures
+            self.signatures = grown
+        self.signatures[position] = signature
+        for band_key in band_keys:
+            self.buckets[band_key].append(position)
+
+    # Signatures of the rows that are not exact duplicates of an earlier row, hashed in one batch
+    def _signatures(self, kb, rows_and_keys):
+        rows, seen = [], set(self.exact)
+        for row, key in rows_and_keys:
+            if key not in seen:
+                seen.add(key)
+                rows.append(row)
+        texts = [" ".join([kb.search_text[row], kb.text("Reply", row), kb.text("Additional Comments", row)]) for row in rows]
+        return dict(zip(rows, self.hasher.signatures_from_hashes(*word_pair_hashes(texts))))
+
+    # Assign rows from `start` on; returns the rows that became canonical (the ones to index)
+    def add_rows(self, kb, start=0):
+        codes = np.stack([kb.codes(column)[start:] for column in TEXT_COLUMNS], axis=1)
+        rows_and_keys = list(enumerate(map(tuple, codes.tolist()), start))
+        signatures = self._signatures(kb, rows_and_keys) if self.threshold > 0 else {}
+        new_canonical = []
+        for row, key in rows_and_keys:
+            canonical = self.exact.get(key)
+            if canonical is not None:
+                self.exact_duplicates += 1
+            else:
+                signature = signatures.get(row)
+                band_keys = None
+                if signature is not None:
+                    band_keys = self._band_keys(signature)
+                    canonical = self._match(signature, band_keys)
+                if canonical is not None:
+                    self.near_duplicates += 1
+                else:
+                    canonical = row
+                    if signature is not None:
+                        self._store(signature, band_keys)
+                    self.canonical_rows.append(row)
+                    new_canonical.append(row)
+                self.exact[key] = canonical
+            self.row_to_canonical.append(canonical)
+            self.counts[canonical] += 1
+        return new_canonical
+
+    def count(self, row):
+        return self.counts.get(row, 1)
+
+    # Size of the compaction, plus the BM25 postings it saved when given the built index
+    def report(self, search_index=None):
+        rows = len(self.row_to_canonical)
+        canonical = len(self.canonical_rows)
+        report = {
+            "rows": rows,
+            "canonical_rows": canonical,
+            "exact_duplicates": self.exact_duplicates,
+            "near_duplicates": self.near_duplicates,
+            "index_reduction": round(1 - canonical / rows, 4) if rows else 0.0,
+        }
+        doc_lengths = getattr(search_index, "doc_lengths", None)
+        if doc_lengths is not None and len(doc_lengths) == canonical and search_index.total_length:
+            # Each duplicate would have added about its canonical row's postings again
+            postings_per_token = search_index.posting_count / search_index.total_length
+            saved_tokens = sum((self.counts[row] - 1) * length for row, length in zip(self.canonical_rows, doc_lengths))
+            report["postings"] = search_index.posting_count
+            report["postings_saved"] = int(saved_tokens * postings_per_token)
+            report["index_bytes_saved_estimate"] = report["postings_saved"] * POSTING_BYTES
+        return report
@@ -0,0 +1,393 @@
+import os
+import time
+import logging
+import threading
+from dataclasses import dataclass, field
+from dotenv import load_dotenv
+from kb_loader import get_loader, PrefixKnowledgeBaseLoader
+from knowledge_base import KnowledgeBase, TEXT_COLUMNS
+from categorizer import determine_sub_category, summarize_user_input
+from retrieval import build_search_index, build_fuzzy_matcher
+from semantic import load_or_build_embedding_index
+from dedupe import RowDeduplicator
+from faq import build_faq_questions
+from clustering import SubjectClusterer
+from answer_cache import AnswerCache, make_cache_key, history_context
+from llm import chat_completion, stream_chat_completion, batch_chat_completions
+from prompt_builder import PromptBuilder, count_tokens
+from ticket_store import TicketStore
+from popularity import PopularityStore
+from singleflight import SingleFlight
+from metrics import metrics, span
+
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+AWS_ACCESS_KEY_ID = os.getenv("ACCESS_KEY")
+AWS_SECRET_ACCESS_KEY = os.getenv("SECRET_ACCESS_KEY")
+AWS_REGION = os.getenv("REGION_NAME")
+AWS_BUCKET = os.getenv("BUCKET_NAME")
+KB_FILE_KEY = os.getenv("KB_FILE_KEY", "Good_copy_fixed_anonymised_data.csv")
+KB_PREFIX = os.getenv("KB_PREFIX")  # load every CSV under this prefix instead of KB_FILE_KEY
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "keyword")  # "keyword" or "semantic"
+
+
+# Function to create the S3 client from the environment (boto3 is imported on first use)
+def create_s3_client():
+    import boto3
+    return boto3.client(
+        's3',
+        aws_access_key_id=AWS_ACCESS_KEY_ID,
+        aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
+        region_name=AWS_REGION
+    )
+
+
+# Function to generate a question from a term
+def question_prompt(term):
+    return f"""
+    Transform '{term}' directly into a clear question. 
+    The question must end with a question mark, and not be enclosed with quotation marks.
+    """
+
+
+# Everything built from one knowledge-base version; replaced as a whole when the data changes
+@dataclass
+class IndexState:
+    version: str
+    kb: KnowledgeBase
+    search_index: object
+    fuzzy_matcher: object
+    dedupe: RowDeduplicator = None
+    faq_questions: list = None
+
+
+@dataclass
+class Answer:
+    text: str = None
+    tokens: object = None  # iterator of text fragments when streaming; text is set once it is exhausted
+    rows: list = field(default_factory=list)
+    usage: dict = field(default_factory=dict)
+    cached: bool = False
+    coalesced: bool = False  # shared the completion of an identical request already in flight
+
+
+# Headless chat engine: knowledge-base loading, retrieval, prompt assembly,
+# generation, categorisation and ticket logging, with no Streamlit dependency.
+# One instance is shared by every session (or request) in a process.
+class ChatEngine:
+    def __init__(self, s3=None, bucket_name=AWS_BUCKET, file_key=KB_FILE_KEY, retrieval_mode=RETRIEVAL_MODE,
+                 answer_cache=None, prompt_builder=None, ticket_store=None, prefix=KB_PREFIX, popularity=None):
+        self.s3 = s3 or create_s3_client()
+        if prefix:
+            self.loader = PrefixKnowledgeBaseLoader(self.s3, bucket_name, prefix, usecols=TEXT_COLUMNS)
+        else:
+            self.loader = get_loader(self.s3, bucket_name, file_key, usecols=TEXT_COLUMNS)
+        self.retrieval_mode = retrieval_mode
+        self.answer_cache = answer_cache or AnswerCache()
+        self.prompt_builder = prompt_builder or PromptBuilder()
+        self._ticket_store = ticket_store
+        self._popularity = popularity
+        self.precomputer = None
+        self.state = None
+        self._lock = threading.Lock()
+        self._refreshing = threading.Lock()  # held while a background refresh runs
+        self._next_refresh = 0.0
+        self._faq_lock = threading.Lock()
+        # Identical concurrent answers (same prompt, context and data version) share one completion
+        self.answer_flights = SingleFlight("answer")
+        # Kept across knowledge-base versions so only newly seen subjects are clustered
+        self.subject_clusterer = SubjectClusterer()
+        self._register_metrics()
+
+    def _register_metrics(self):
+        cache = self.answer_cache
+        metrics.register_gauge("answer_cache_hit_ratio", cache.hit_rate)
+        for stat in cache.stats:
+            metrics.register_gauge("answer_cache_events_total", lambda stat=stat: cache.stats[stat], kind="counter", event=stat)
+        metrics.register_gauge("kb_rows", lambda: len(self.state.kb) if self.state else 0)
+        metrics.register_gauge("singleflight_in_flight", self.answer_flights.in_flight, flight="answer")
+        metrics.register_gauge("kb_canonical_rows", lambda: len(self.state.dedupe.canonical_rows) if self.state else 0)
+
+    @property
+    def ticket_store(self):
+        if self._ticket_store is None:
+            self._ticket_store = TicketStore()
+        return self._ticket_store
+
+    # Query counts shared across sessions, used to pick the answers to precompute
+    @property
+    def popularity(self):
+        if self._popularity is None:
+            self._popularity = PopularityStore()
+        return self._popularity
+
+    # Function to start refreshing the answers to the FAQ and most asked queries in the background
+    def start_precompute(self, **options):
+        from precompute import AnswerPrecomputer
+        if self.precomputer is None:
+            self.precomputer = AnswerPrecomputer(self, **options).start()
+        return self.precomputer
+
+    # The current index state. Only the first call (nothing loaded yet) waits for the load; after
+    # that, once the loader's refresh interval has passed, revalidation and any rebuild run on a
+    # background thread while callers keep getting the current state until the new one is swapped in.
+    def current(self):
+        state = self.state
+        if state is None:
+            return self.refresh()
+        now = time.monotonic()
+        if now >= self._next_refresh and self._refreshing.acquire(blocking=False):
+            self._next_refresh = now + getattr(self.loader, "refresh_interval", 0)
+            threading.Thread(target=self._refresh_in_background, name="kb-refresh", daemon=True).start()
+        return state
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        except Exception:
+            logger.exception("Could not refresh the knowledge base")
+            metrics.inc("kb_refresh_errors_total")
+        finally:
+            self._refreshing.release()
+
+    # Load (or revalidate) the knowledge base and, if its version changed, build the new state
+    # (and its FAQ, if the FAQ is in use) before swapping it in. Blocks; builds are serialised
+    # and always follow the loader's latest version, so an older build never replaces a newer one.
+    def refresh(self):
+        with self._lock:
+            version, data = self.loader.get_with_version()
+            self._next_refresh = time.monotonic() + getattr(self.loader, "refresh_interval", 0)
+            if self.state is not None and self.state.version == version:
+                return self.state
+            if data is None or data.empty:
+                raise ValueError("The knowledge base is empty.")
+            missing = set(TEXT_COLUMNS) - set(data.columns)
+            if missing:
+                raise ValueError(f"Missing required columns in the data: {missing}")
+            with span("index_build", rows=len(data)) as s:
+                start = self._appended_from(version)
+                s["incremental"] = start is not None
+                if start is not None:
+                    state = self._extend_state(data.iloc[start:], version)
+                else:
+                    state = self._build_state(data, version)
+            if self.state is not None and self.state.faq_questions is not None:
+                try:
+                    self._build_faq(state)
+                except Exception:
+                    logger.exception("Could not rebuild the FAQ questions; they will be built on first use")
+            self.state = state
+            return state
+
+    # First new row when this version only appends rows to the current state, else None
+    def _appended_from(self, version):
+        change = getattr(self.loader, "last_change", None)
+        if self.state is None or not change or change["version"] != version or change["previous"] != self.state.version:
+            return None
+        if change["appended_from"] != len(self.state.kb):
+            return None
+        return change["appended_from"]
+
+    # Extend the current indexes with appended rows. The inverted index, fuzzy matcher and
+    # duplicate mapping grow in place (searches on the old state ignore rows past its
+    # knowledge base); only appended rows that are not duplicates get indexed.
+    def _extend_state(self, new_rows, version):
+        state = self.state
+        start = len(state.kb)
+        with span("kb_build", incremental=True):
+            kb = state.kb.extend(new_rows, version)
+        with span("dedupe", incremental=True) as s:
+            rows = state.dedupe.add_rows(kb, start)
+            s["rows"] = len(kb) - start
+            s["canonical_rows"] = len(rows)
+        with span("search_index_build", mode=self.retrieval_mode, incremental=True):
+            if self.retrieval_mode == "semantic":
+                search_index = state.search_index.extend([kb.search_text[row] for row in rows], rows)
+            else:
+                search_index = build_search_index(kb, state.search_index, rows=rows)
+        with span("fuzzy_index_build", incremental=True):
+            fuzzy_matcher = build_fuzzy_matcher(kb, matcher=state.fuzzy_matcher, rows=rows)
+        return IndexState(version, kb, search_index, fuzzy_matcher, state.dedupe)
+
+    def _build_state(self, data, version):
+        with span("kb_build"):
+            kb = KnowledgeBase(data, version)
+        with span("dedupe") as s:
+            dedupe = RowDeduplicator()
+            rows = dedupe.add_rows(kb)
+            s["rows"] = len(kb)
+            s["canonical_rows"] = len(rows)
+        with span("search_index_build", mode=self.retrieval_mode):
+            if self.retrieval_mode == "semantic":
+                search_index = load_or_build_embedding_index(kb, version, rows=rows)
+            else:
+                search_index = build_search_index(kb, rows=rows)
+        with span("fuzzy_index_build"):
+            fuzzy_matcher = build_fuzzy_matcher(kb, rows=rows)
+        logger.info("Knowledge base %s compacted: %s", version, dedupe.report(search_index))
+        return IndexState(version, kb, search_index, fuzzy_matcher, dedupe)
+
+    @property
+    def version(self):
+        return self.current().version
+
+    # Function to get the rows most relevant to a prompt, falling back to fuzzy matching;
+    # pass the state to read the rows against the same knowledge-base version
+    def retrieve(self, prompt, k=10, state=None):
+        state = state or self.current()
+        with span("retrieve", mode=self.retrieval_mode) as s:
+            rows = [row for row, score in state.search_index.search(prompt, k=k) if row < len(state.kb)]
+            s["rows"] = len(rows)
+        if not rows:
+            try:
+                with span("fuzzy_fallback") as s:
+                    rows = [row for row, score in state.fuzzy_matcher.search(prompt, k=k) if row < len(state.kb)]
+                    s["rows"] = len(rows)
+            except Exception:
+                logger.exception("Error processing fuzzy matches")
+        return rows
+
+    # Function to answer a prompt given the conversation so far (messages include the prompt itself);
+    # refresh=True skips the answer cache lookup and overwrites the cached answer
+    def answer(self, prompt, messages, stream=False, refresh=False):
+        state = self.current()
+        rows = self.retrieve(prompt, state=state)
+        replies = [state.kb.replies(row) for row in rows]
+
+        # Assemble the prompt within the token budget (dedupes and trims replies and older turns)
+        with span("prompt_build") as s:
+            built_prompt = self.prompt_builder.build(prompt, replies, messages)
+            s["tokens"] = built_prompt.usage.get("total")
+        result = Answer(rows=rows, usage=built_prompt.usage)
+
+        # Serve repeated questions over the same rows and conversation from the answer cache
+        cache_key = make_cache_key(prompt, rows, history_context(prompt, messages), state.version)
+        msg = None
+        if not refresh:
+            with span("answer_cache_lookup") as s:
+                msg = self.answer_cache.get(cache_key)
+                s["hit"] = msg is not None
+        if msg is not None:
+            result.text = msg
+            result.cached = True
+            result.tokens = iter([msg]) if stream else None
+            return result
+
+        llm_messages = [{"role": "user", "content": built_prompt.text}]
+        prompt_tokens = built_prompt.usage.get("total", 0)
+        if stream:
+            result.tokens = self._stream(llm_messages, prompt_tokens, cache_key, result)
+            return result
+
+        flight, leader = self.answer_flights.join(cache_key)
+        if leader:
+            self._complete(llm_messages, prompt_tokens, cache_key, flight)
+        result.text = flight.wait()
+        result.coalesced = not leader
+        return result
+
+    # Run the completion for a flight, caching the answer before the flight's callers see it
+    def _complete(self, llm_messages, prompt_tokens, cache_key, flight):
+        try:
+            metrics.inc("llm_tokens_total", prompt_tokens, kind="prompt")
+            with span("llm_completion") as s:
+                text = chat_completion(llm_messages, temperature=0.3)
+                s["completion_tokens"] = self._count_completion(text)
+            self.answer_cache.set(cache_key, text)
+        except Exception as e:
+            self.answer_flights.finish(cache_key, flight, error=e)
+        else:
+            self.answer_flights.finish(cache_key, flight, text)
+
+    # Stream the completion through a flight. The leader's stream is read by a worker
+    # thread, so the answer is finished and cached even if this caller stops reading,
+    # and every identical concurrent request replays the same fragments.
+    def _stream(self, llm_messages, prompt_tokens, cache_key, result):
+        flight, leader = self.answer_flights.join(cache_key)
+        result.coalesced = not leader
+        if leader:
+            threading.Thread(target=self._pump, args=(llm_messages, prompt_tokens, cache_key, flight), name="answer-stream", daemon=True).start()
+        parts = []
+        for token in flight.follow():
+            parts.append(token)
+            yield token
+        result.text = "".join(parts).strip()
+
+    def _pump(self, llm_messages, prompt_tokens, cache_key, flight):
+        try:
+            metrics.inc("llm_tokens_total", prompt_tokens, kind="prompt")
+            parts = []
+            with span("llm_stream") as s:
+                started = time.perf_counter()
+                for token in stream_chat_completion(llm_messages):
+                    if not parts:
+                        s["first_token_ms"] = round((time.perf_counter() - started) * 1000, 3)
+                    parts.append(token)
+                    flight.publish(token)
+                text = "".join(parts).strip()
+                s["completion_tokens"] = self._count_completion(text)
+            self.answer_cache.set(cache_key, text)
+        except Exception as e:
+            logger.error("Error streaming answer: %s", e)
+            self.answer_flights.finish(cache_key, flight, error=e)
+        else:
+            self.answer_flights.finish(cache_key, flight, text)
+
+    def _count_completion(self, text):
+        tokens = count_tokens(text)
+        metrics.inc("llm_tokens_total", tokens, kind="completion")
+        return tokens
+
+    # Function to generate questions from several terms, requesting them concurrently
+    def generate_questions(self, terms):
+        with span("faq_generate", terms=len(terms)):
+            results = batch_chat_completions([[{"role": "user", "content": question_prompt(term)}] for term in terms], temperature=0.3)
+        questions = []
+        for term, result in zip(terms, results):
+            if isinstance(result, Exception):
+                logger.error("Error generating question: %s", result)
+                metrics.inc("faq_generate_errors_total")
+                questions.append(term)
+            else:
+                questions.append(result)
+        return questions
+
+    # Function to get the FAQ questions, built once per knowledge-base version and cached on disk
+    def faq_questions(self):
+        return self._build_faq(self.current())
+
+    def _build_faq(self, state):
+        with self._faq_lock:
+            if state.faq_questions is None:
+                state.faq_questions = build_faq_questions(state.kb, state.version, self.generate_questions,
+                                                          clusterer=self.subject_clusterer)
+        return state.faq_questions
+
+    # Function to get the most requested subject clusters behind the FAQ, with their ticket counts
+    def faq_clusters(self, top_n=20):
+        self.faq_questions()
+        return [{"label": c.label, "count": c.count, "subjects": c.size} for c in self.subject_clusterer.top(top_n)]
+
+    def categorize(self, user_query, faq_term=None):
+        return determine_sub_category(user_query, faq_term)
+
+    def summarize(self, text):
+        return summarize_user_input(text)
+
+    def log_ticket(self, sub_category, subject, details, transcript, opened_at=None):
+        return self.ticket_store.submit(sub_category, subject, details, transcript, opened_at)
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+# Function to get the process-wide engine configured from the environment
+def get_engine():
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = ChatEngine()
+        return _engine
@@ -0,0 +1,89 @@
+import os
+import json
+import threading
+from metrics import metrics, span
+from clustering import SubjectClusterer
+
+FAQ_CACHE_PATH = os.getenv("FAQ_CACHE_PATH", os.path.join(".kb_cache", "faq_questions.json"))
+FAQ_CACHE_VERSIONS = int(os.getenv("FAQ_CACHE_VERSIONS", "2"))  # knowledge-base versions whose questions are kept
+
+
+# Function to group similar subjects using fuzzy matching, keeping the first of each group
+def group_similar_subjects(subjects, threshold=80):
+    clusterer = SubjectClusterer(threshold)
+
+    with span("faq_grouping", subjects=len(subjects)) as s:
+        for subject in subjects:
+            clusterer.add(subject)
+        unique_subjects = [cluster.label for cluster in clusterer.clusters]
+        s["groups"] = len(unique_subjects)
+
+    return unique_subjects
+
+
+# Persistent map of data version -> {term: generated FAQ question}, stored as JSON.
+# Only the `versions` most recently written knowledge-base versions are kept.
+class FAQCache:
+    def __init__(self, path=FAQ_CACHE_PATH, versions=FAQ_CACHE_VERSIONS):
+        self.path = path
+        self.versions = versions
+        self._lock = threading.Lock()
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                # Files in the older flat (hashed key -> question) format are dropped
+                self.entries = {version: questions for version, questions in json.load(f).items() if isinstance(questions, dict)}
+        except (OSError, ValueError, AttributeError):
+            self.entries = {}
+
+    def get(self, version, term):
+        return self.entries.get(str(version), {}).get(term)
+
+    def set(self, version, term, question):
+        with self._lock:
+            # Re-inserting moves the version to the end, so the oldest version comes first
+            questions = self.entries.pop(str(version), {})
+            questions[term] = question
+            self.entries[str(version)] = questions
+
+    def save(self):
+        with self._lock:
+            while len(self.entries) > max(1, self.versions):
+                del self.entries[next(iter(self.entries))]
+            try:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                with open(self.path + ".tmp", 'w', encoding='utf-8') as f:
+                    json.dump(self.entries, f)
+                os.replace(self.path + ".tmp", self.path)
+            except OSError:
+                pass
+
+
+# Function to pick the labels of the most requested subject clusters across the whole
+# knowledge base. Pass a long-lived clusterer to only cluster subjects added since last time.
+def top_faq_terms(kb, top_n=20, threshold=80, clusterer=None):
+    clusterer = clusterer or SubjectClusterer(threshold)
+    with span("faq_clustering") as s:
+        s["subjects_added"] = clusterer.update(kb.value_counts("Subject"))
+        s["clusters"] = len(clusterer.clusters)
+    return [cluster.label for cluster in clusterer.top(top_n)]
+
+
+# Function to build the FAQ questions for a knowledge-base version.
+# Only uncached terms are generated, in one batch call to generate_questions(terms).
+def build_faq_questions(kb, version, generate_questions, cache=None, top_n=20, clusterer=None):
+    cache = cache or FAQCache()
+    terms = top_faq_terms(kb, top_n, clusterer=clusterer)
+    questions = {term: cache.get(version, term) for term in terms}
+
+    missing = [term for term in terms if questions[term] is None]
+    metrics.inc("faq_cache_lookups_total", len(terms) - len(missing), result="hit")
+    metrics.inc("faq_cache_lookups_total", len(missing), result="miss")
+    if missing:
+        for term, question in zip(missing, generate_questions(missing)):
+            questions[term] = question
+            # generate_questions falls back to the term itself on error; don't persist that
+            if question != term:
+                cache.set(version, term, question)
+        cache.save()
+
+    return [questions[term] for term in terms]
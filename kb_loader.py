@@ -0,0 +1,412 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from metrics import metrics, span
+
+logger = logging.getLogger(__name__)
+
+# How often (in seconds) a cached knowledge base is revalidated against S3
+KB_REFRESH_INTERVAL = float(os.getenv("KB_REFRESH_INTERVAL", "300"))
+# Where parsed snapshots are kept so a cold restart can skip the download
+KB_SNAPSHOT_DIR = os.getenv("KB_SNAPSHOT_DIR", ".kb_cache")
+# Objects at least this large are fetched as parallel ranged GETs of KB_PART_SIZE bytes
+KB_RANGE_THRESHOLD = int(os.getenv("KB_RANGE_THRESHOLD", str(32 << 20)))
+KB_PART_SIZE = int(os.getenv("KB_PART_SIZE", str(8 << 20)))
+KB_DOWNLOAD_WORKERS = int(os.getenv("KB_DOWNLOAD_WORKERS", "4"))
+KB_CSV_CHUNK_ROWS = int(os.getenv("KB_CSV_CHUNK_ROWS", "50000"))
+
+# Bytes that are undefined in cp1252; if any appear the export is ISO-8859-1
+CP1252_UNDEFINED = (b"\x81", b"\x8d", b"\x8f", b"\x90", b"\x9d")
+
+
+# Function to decode raw CSV bytes the same way the ITSM exports are encoded
+def decode_csv_bytes(csv_content):
+    try:
+        return csv_content.decode('cp1252')
+    except UnicodeDecodeError:
+        return csv_content.decode('ISO-8859-1')
+
+
+# Function to tell whether a block of bytes rules out cp1252 (same rule as decode_csv_bytes)
+def has_cp1252_undefined(block):
+    return any(byte in block for byte in CP1252_UNDEFINED)
+
+
+# Function to parse a CSV file in row chunks, keeping only the wanted columns.
+# Missing columns are skipped rather than raising, so callers can report them.
+def read_csv_chunked(path, encoding, usecols=None, chunk_rows=KB_CSV_CHUNK_ROWS):
+    columns = None if usecols is None else (lambda column: column in usecols)
+    frames = list(pd.read_csv(path, encoding=encoding, usecols=columns, chunksize=chunk_rows))
+    if not frames:
+        return pd.read_csv(path, encoding=encoding, usecols=columns, nrows=0)
+    return pd.concat(frames, ignore_index=True)
+
+
+# Function to write a frame as an uncompressed Arrow IPC file that can be memory-mapped,
+# or as a pickle when pyarrow is not installed. Returns the format written.
+def write_columnar(data, path):
+    try:
+        from pyarrow import feather
+    except ImportError:
+        data.to_pickle(path)
+        return "pickle"
+    feather.write_feather(data, path, compression="uncompressed")
+    return "arrow"
+
+
+# Function to read a frame written by write_columnar. Arrow files are memory-mapped and
+# their strings kept Arrow-backed, so the text is paged in from the file instead of copied.
+def read_columnar(path, fmt):
+    if fmt == "pickle":
+        return pd.read_pickle(path)
+    import pyarrow as pa
+    from pyarrow import feather
+    table = feather.read_table(path, memory_map=True)
+    string_dtype = pd.StringDtype("pyarrow")
+    return table.to_pandas(types_mapper=lambda t: string_dtype if pa.types.is_string(t) or pa.types.is_large_string(t) else None)
+
+
+# Function to build a version string from a head_object/get_object response
+def object_version(response):
+    etag = response.get('ETag', '').strip('"')
+    last_modified = response.get('LastModified')
+    if last_modified is not None and hasattr(last_modified, 'isoformat'):
+        last_modified = last_modified.isoformat()
+    return f"{etag}|{last_modified}"
+
+
+# Loads a CSV object from S3 once and serves it from memory until it changes.
+# The object is revalidated with a cheap head_object call at most once per
+# refresh interval, and the parsed frame is snapshotted to local disk.
+# Downloads stream to a temporary file (in parallel byte ranges for large objects)
+# and are parsed from there in chunks, so the raw bytes are never held in memory.
+class KnowledgeBaseLoader:
+    def __init__(self, s3, bucket_name, file_key, refresh_interval=KB_REFRESH_INTERVAL, snapshot_dir=KB_SNAPSHOT_DIR,
+                 usecols=None, range_threshold=KB_RANGE_THRESHOLD, part_size=KB_PART_SIZE,
+                 download_workers=KB_DOWNLOAD_WORKERS, chunk_rows=KB_CSV_CHUNK_ROWS):
+        self.s3 = s3
+        self.bucket_name = bucket_name
+        self.file_key = file_key
+        self.refresh_interval = refresh_interval
+        self.snapshot_dir = snapshot_dir
+        self.usecols = usecols
+        self.range_threshold = range_threshold
+        self.part_size = part_size
+        self.download_workers = download_workers
+        self.chunk_rows = chunk_rows
+        self.data = None
+        self.version = None
+        self._last_checked = None
+        self._lock = threading.Lock()
+
+    def _snapshot_paths(self):
+        name = hashlib.sha1(f"{self.bucket_name}/{self.file_key}".encode('utf-8')).hexdigest()[:16]
+        base = os.path.join(self.snapshot_dir, name)
+        return base + ".data", base + ".json"
+
+    def _load_snapshot(self, version=None):
+        data_path, meta_path = self._snapshot_paths()
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            if version is not None and meta.get('version') != version:
+                return None
+            return meta['version'], read_columnar(data_path, meta['format'])
+        except (OSError, ValueError, KeyError, ImportError):
+            return None
+
+    def _save_snapshot(self, version, data):
+        data_path, meta_path = self._snapshot_paths()
+        try:
+            os.makedirs(self.snapshot_dir, exist_ok=True)
+            # A memory-mapped snapshot may be in use, so always write a new file and swap it in
+            fmt = write_columnar(data, data_path + ".tmp")
+            os.replace(data_path + ".tmp", data_path)
+            with open(meta_path + ".tmp", 'w', encoding='utf-8') as f:
+                json.dump({"bucket": self.bucket_name, "key": self.file_key, "version": version,
+                           "format": fmt, "saved_at": time.time()}, f)
+            os.replace(meta_path + ".tmp", meta_path)
+        except OSError:
+            # A snapshot is only an optimisation; the in-memory copy is still valid
+            pass
+
+    # Stream the object into f block by block; returns (version, cp1252 ruled out)
+    def _fetch_stream(self, f):
+        response = self.s3.get_object(Bucket=self.bucket_name, Key=self.file_key)
+        body = response['Body']
+        latin1 = False
+        while True:
+            block = body.read(self.part_size)
+            if not block:
+                break
+            latin1 = latin1 or has_cp1252_undefined(block)
+            f.write(block)
+        return object_version(response), latin1
+
+    # Fetch the object as concurrent ranged GETs written at their offsets in f. IfMatch
+    # pins every part to the revalidated ETag, so a mid-download update fails instead of mixing versions.
+    def _fetch_ranges(self, f, size, etag):
+        def fetch(start):
+            end = min(size, start + self.part_size) - 1
+            response = self.s3.get_object(Bucket=self.bucket_name, Key=self.file_key,
+                                          Range=f"bytes={start}-{end}", IfMatch=etag)
+            block = response['Body'].read()
+            os.pwrite(f.fileno(), block, start)
+            return object_version(response), has_cp1252_undefined(block)
+
+        with ThreadPoolExecutor(max_workers=self.download_workers, thread_name_prefix="kb-download") as executor:
+            parts = list(executor.map(fetch, range(0, size, self.part_size)))
+        return parts[0][0], any(latin1 for _, latin1 in parts)
+
+    # Fetch and parse the object as it is now; returns (version, data) without touching the snapshot
+    def download(self, size=None, etag=None):
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        fd, path = tempfile.mkstemp(dir=self.snapshot_dir, suffix=".csv.part")
+        try:
+            with span("s3_fetch") as s:
+                with os.fdopen(fd, 'wb') as f:
+                    if size and etag and size >= self.range_threshold:
+                        s["parts"] = -(-size // self.part_size)
+                        version, latin1 = self._fetch_ranges(f, size, etag)
+                    else:
+                        version, latin1 = self._fetch_stream(f)
+                s["bytes"] = os.path.getsize(path)
+            encoding = 'ISO-8859-1' if latin1 else 'cp1252'
+            with span("csv_parse", encoding=encoding) as s:
+                data = read_csv_chunked(path, encoding, self.usecols, self.chunk_rows)
+                s["rows"] = len(data)
+        finally:
+            os.remove(path)
+        return version, data
+
+    def _is_fresh(self, now):
+        return self._last_checked is not None and now - self._last_checked < self.refresh_interval
+
+    # Return (version, data), revalidating against S3 once the refresh interval has passed
+    def get_with_version(self, force_refresh=False):
+        with self._lock:
+            now = time.monotonic()
+            if self.data is not None and not force_refresh and self._is_fresh(now):
+                return self.version, self.data
+
+            try:
+                with span("s3_revalidate"):
+                    head = self.s3.head_object(Bucket=self.bucket_name, Key=self.file_key)
+                    version = object_version(head)
+            except Exception:
+                metrics.inc("kb_revalidations_total", result="error")
+                # S3 is unreachable: keep serving what we have, or fall back to the last snapshot
+                if self.data is None:
+                    snapshot = self._load_snapshot()
+                    if snapshot is None:
+                        raise
+                    self.version, self.data = snapshot
+                self._last_checked = now
+                return self.version, self.data
+
+            metrics.inc("kb_revalidations_total", result="unchanged" if version == self.version else "changed")
+            if version != self.version:
+                with span("snapshot_load"):
+                    snapshot = self._load_snapshot(version)
+                if snapshot is None:
+                    try:
+                        version, data = self.download(head.get('ContentLength'), head.get('ETag'))
+                    except Exception:
+                        if self.data is None:
+                            raise
+                        # Keep serving the current version; retry after the refresh interval
+                        logger.exception("Could not download s3://%s/%s; serving version %s", self.bucket_name, self.file_key, self.version)
+                        metrics.inc("kb_downloads_failed_total")
+                        self._last_checked = now
+                        return self.version, self.data
+                    self._save_snapshot(version, data)
+                    snapshot = (version, data)
+                self.version, self.data = snapshot
+
+            self._last_checked = now
+            return self.version, self.data
+
+    def get(self, force_refresh=False):
+        return self.get_with_version(force_refresh)[1]
+
+
+# Loads every CSV under an S3 prefix (e.g. daily ITSM exports) as one knowledge base, in key order.
+# A manifest records the ETag, row count and local columnar copy of each ingested partition, so a
+# refresh lists the prefix and only downloads new or changed partitions, concurrently. When the
+# change only adds partitions after the existing ones, last_change["appended_from"] gives the first
+# new row so the indexes can be extended instead of rebuilt.
+class PrefixKnowledgeBaseLoader:
+    def __init__(self, s3, bucket_name, prefix, refresh_interval=KB_REFRESH_INTERVAL, snapshot_dir=KB_SNAPSHOT_DIR,
+                 usecols=None, max_workers=KB_DOWNLOAD_WORKERS, suffix=".csv"):
+        self.s3 = s3
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+        self.refresh_interval = refresh_interval
+        self.usecols = usecols
+        self.max_workers = max_workers
+        self.suffix = suffix
+        name = hashlib.sha1(f"{bucket_name}/{prefix}".encode('utf-8')).hexdigest()[:16]
+        self.partition_dir = os.path.join(snapshot_dir, name)
+        self.manifest_path = os.path.join(self.partition_dir, "manifest.json")
+        self.manifest = self._load_manifest()
+        self.frames = {}
+        self.keys = []
+        self.data = None
+        self.version = None
+        self.last_change = None
+        self._last_checked = None
+        self._lock = threading.Lock()
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                return json.load(f)["partitions"]
+        except (OSError, ValueError, KeyError):
+            return {}
+
+    def _save_manifest(self):
+        try:
+            with open(self.manifest_path + ".tmp", 'w', encoding='utf-8') as f:
+                json.dump({"bucket": self.bucket_name, "prefix": self.prefix, "version": self.version,
+                           "partitions": self.manifest, "saved_at": time.time()}, f)
+            os.replace(self.manifest_path + ".tmp", self.manifest_path)
+        except OSError:
+            pass
+
+    # List the partitions under the prefix: key -> (etag, size)
+    def _list(self):
+        objects = {}
+        kwargs = {"Bucket": self.bucket_name, "Prefix": self.prefix}
+        while True:
+            response = self.s3.list_objects_v2(**kwargs)
+            for obj in response.get('Contents', []):
+                if obj['Key'].lower().endswith(self.suffix):
+                    objects[obj['Key']] = (obj['ETag'], obj.get('Size'))
+            if not response.get('IsTruncated'):
+                return objects
+            kwargs["ContinuationToken"] = response['NextContinuationToken']
+
+    # Read a partition from its local copy when the manifest says it is current, else download it
+    def _ingest(self, key, etag, size):
+        entry = self.manifest.get(key)
+        if entry is not None and entry["etag"] == etag:
+            try:
+                return key, read_columnar(os.path.join(self.partition_dir, entry["file"]), entry["format"]), False
+            except (OSError, ValueError, ImportError):
+                pass
+
+        loader = KnowledgeBaseLoader(self.s3, self.bucket_name, key, snapshot_dir=self.partition_dir, usecols=self.usecols)
+        version, data = loader.download(size, etag)
+        file_name = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16] + ".data"
+        try:
+            fmt = write_columnar(data, os.path.join(self.partition_dir, file_name + ".tmp"))
+            os.replace(os.path.join(self.partition_dir, file_name + ".tmp"), os.path.join(self.partition_dir, file_name))
+            self.manifest[key] = {"etag": etag, "rows": len(data), "file": file_name, "format": fmt}
+        except OSError:
+            self.manifest.pop(key, None)
+        return key, data, True
+
+    def _merge(self, listing, changed):
+        previous_keys = self.keys
+        keys = sorted(listing)
+        removed = [key for key in previous_keys if key not in listing]
+        for key in removed:
+            self.frames.pop(key, None)
+            self.manifest.pop(key, None)
+        if changed:
+            try:
+                with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="kb-partition") as executor:
+                    results = list(executor.map(lambda key: self._ingest(key, *listing[key]), changed))
+            except Exception:
+                # Partitions that did get ingested updated the manifest; forget their stale frames
+                # so the next refresh reads them again (from the local copy) instead of skipping them
+                for key in changed:
+                    self.frames.pop(key, None)
+                raise
+            downloaded = 0
+            for key, data, fetched in results:
+                self.frames[key] = data
+                downloaded += fetched
+            metrics.inc("kb_partitions_downloaded_total", downloaded)
+
+        appended = (self.data is not None and not removed and keys[:len(previous_keys)] == previous_keys
+                    and not any(key in previous_keys for key in changed))
+        frames = [self.frames[key] for key in keys]
+        data = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=self.usecols or [])
+        version = hashlib.sha1(json.dumps([[key, listing[key][0]] for key in keys]).encode('utf-8')).hexdigest()
+        self.last_change = {
+            "version": version,
+            "previous": self.version,
+            "appended_from": len(self.data) if appended else None,
+            "changed": changed,
+            "removed": removed,
+        }
+        self.keys, self.data, self.version = keys, data, version
+
+    # Return (version, data), relisting the prefix once the refresh interval has passed
+    def get_with_version(self, force_refresh=False):
+        with self._lock:
+            now = time.monotonic()
+            if self.data is not None and not force_refresh and self._last_checked is not None \
+                    and now - self._last_checked < self.refresh_interval:
+                return self.version, self.data
+
+            try:
+                with span("s3_list") as s:
+                    listing = self._list()
+                    s["partitions"] = len(listing)
+            except Exception:
+                metrics.inc("kb_revalidations_total", result="error")
+                if self.data is None:
+                    # S3 is unreachable: fall back to the partitions ingested last time
+                    listing = {key: (entry["etag"], None) for key, entry in self.manifest.items()}
+                    if not listing:
+                        raise
+                    self._merge(listing, sorted(listing))
+                self._last_checked = now
+                return self.version, self.data
+
+            changed = sorted(key for key, (etag, size) in listing.items()
+                             if key not in self.frames or self.manifest.get(key, {}).get("etag") != etag)
+            removed = [key for key in self.keys if key not in listing]
+            metrics.inc("kb_revalidations_total", result="changed" if changed or removed or self.data is None else "unchanged")
+            if changed or removed or self.data is None:
+                os.makedirs(self.partition_dir, exist_ok=True)
+                try:
+                    with span("kb_partitions_merge", changed=len(changed), removed=len(removed)):
+                        self._merge(listing, changed)
+                except Exception:
+                    if self.data is None:
+                        raise
+                    # Keep serving the current version; retry after the refresh interval
+                    logger.exception("Could not ingest partitions under s3://%s/%s; serving version %s", self.bucket_name, self.prefix, self.version)
+                    metrics.inc("kb_downloads_failed_total")
+                    self._last_checked = now
+                    return self.version, self.data
+                self._save_manifest()
+
+            self._last_checked = now
+            return self.version, self.data
+
+    def get(self, force_refresh=False):
+        return self.get_with_version(force_refresh)[1]
+
+
+_loaders = {}
+_loaders_lock = threading.Lock()
+
+
+# Function to get the process-wide loader for a bucket/key so every session shares it
+def get_loader(s3, bucket_name, file_key, **kwargs):
+    with _loaders_lock:
+        loader = _loaders.get((bucket_name, file_key))
+        if loader is None:
+            loader = KnowledgeBaseLoader(s3, bucket_name, file_key, **kwargs)
+            _loaders[(bucket_name, file_key)] = loader
+        return loader
@@ -0,0 +1,105 @@
+import numpy as np
+import pandas as pd
+
+TEXT_COLUMNS = ["Details of Query", "Subject", "Reply", "Additional Comments"]
+SEARCH_COLUMNS = ["Details of Query", "Subject"]
+
+
+# Function to pick the most compact string dtype available: Arrow-backed strings when pyarrow is installed
+def _string_dtype():
+    try:
+        import pyarrow  # noqa: F401
+        return "string[pyarrow]"
+    except ImportError:
+        return object
+
+
+# Function to clean one text column once: missing values become '' and everything is str
+def _clean(column):
+    return column.fillna('').astype(str)
+
+
+def _column(data, name):
+    return _clean(data[name]) if name in data.columns else pd.Series([''] * len(data))
+
+
+# Function to build the lowercase search text of each row from its categorical columns
+def _search_text(columns):
+    return (
+        pd.Series(columns[SEARCH_COLUMNS[0]].astype(object))
+        .str.cat([pd.Series(columns[name].astype(object)) for name in SEARCH_COLUMNS[1:]], sep=' ')
+        .str.lower()
+    )
+
+
+# Read-only, preprocessed view of the knowledge base for one data version.
+# Text columns are cleaned once and stored as categoricals (the Reply and
+# Subject columns repeat heavily), and the lowercase search text used by
+# the retrieval indexes is precomputed. Nothing here is mutated after
+# construction, so every session and index can share it without copies.
+class KnowledgeBase:
+    def __init__(self, data, version=None):
+        columns = {}
+        for name in TEXT_COLUMNS:
+            columns[name] = pd.Categorical(_column(data, name).to_numpy())
+        self._set_columns(columns, version, _search_text(columns))
+
+    # Function to build the next version with rows appended. Existing rows keep their
+    # ids and category codes, so indexes over this version can be extended, not rebuilt.
+    def extend(self, data, version=None):
+        columns = {}
+        for name in TEXT_COLUMNS:
+            old = self.columns[name]
+            new = _column(data, name).to_numpy()
+            extra = pd.Index(pd.unique(new)).difference(old.categories, sort=False)
+            categories = old.categories.append(extra)
+            new_codes = pd.Categorical(new, categories=categories).codes
+            columns[name] = pd.Categorical.from_codes(np.concatenate([old.codes, new_codes]), categories=categories)
+        new_text = _search_text({name: column[len(self):] for name, column in columns.items()})
+        search_text = pd.concat([pd.Series(self.search_text), pd.Series(new_text)], ignore_index=True)
+        kb = KnowledgeBase.__new__(KnowledgeBase)
+        kb._set_columns(columns, version, search_text)
+        return kb
+
+    def _set_columns(self, columns, version, search_text):
+        self.version = version
+        self.columns = columns
+        self._codes = {}
+        self._categories = {}
+        for name, column in self.columns.items():
+            codes = np.asarray(column.codes)
+            codes.setflags(write=False)
+            categories = np.asarray(column.categories, dtype=object)
+            categories.setflags(write=False)
+            self._codes[name] = codes
+            self._categories[name] = categories
+
+        self.search_text = pd.array(search_text, dtype=_string_dtype())
+        self.row_ids = np.arange(len(self.search_text), dtype=np.int64)
+        self.row_ids.setflags(write=False)
+
+    def __len__(self):
+        return len(self.row_ids)
+
+    # Text of one cell, looked up through the categorical codes without materialising the column
+    def text(self, column, row):
+        return self._categories[column][self._codes[column][row]]
+
+    # Read-only category codes of a column; equal codes mean equal text
+    def codes(self, column):
+        return self._codes[column]
+
+    # All values of a column as str, in row order
+    def texts(self, column):
+        return self._categories[column][self._codes[column]]
+
+    def replies(self, row):
+        return self.text("Reply", row), self.text("Additional Comments", row)
+
+    def value_counts(self, column):
+        counts = pd.Series(self.columns[column]).value_counts()
+        return counts[counts.index != '']
+
+    def memory_usage(self):
+        total = sum(column.nbytes for column in self.columns.values())
+        return total + self.search_text.nbytes + self.row_ids.nbytes
@@ -0,0 +1,220 @@
+import os
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from metrics import metrics
+
+CHAT_MODEL = os.getenv("CHAT_MODEL", "gpt-4o-mini")
+# "openai" talks to the API; "fake" uses the local FakeStreamingClient (no network)
+LLM_BACKEND = os.getenv("LLM_BACKEND", "openai")
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_RATE_LIMIT = float(os.getenv("LLM_RATE_LIMIT", "5"))  # requests per second, 0 to disable
+LLM_BURST = int(os.getenv("LLM_BURST", "10"))
+LLM_MAX_WORKERS = int(os.getenv("LLM_MAX_WORKERS", "8"))
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "16"))
+
+
+# Function to get the openai errors worth retrying: rate limits, timeouts and transient
+# server/connection failures. openai is only imported once an openai-backed client is created.
+def retryable_errors():
+    import openai
+    return (
+        openai.error.RateLimitError,
+        openai.error.Timeout,
+        openai.error.APIConnectionError,
+        openai.error.ServiceUnavailableError,
+        openai.error.TryAgain,
+        openai.error.APIError,
+    )
+
+
+# Transient failure raised by FakeStreamingClient; the client retries it like the openai errors
+class FakeTransientError(Exception):
+    pass
+
+
+# Local stand-in for openai.ChatCompletion that echoes a canned reply, for offline runs and tests.
+# Chunks have the same shape as the API's streamed chat.completion.chunk objects, and
+# `errors` can be pre-loaded with exceptions to raise on the next calls.
+class FakeStreamingClient:
+    retryable_errors = (FakeTransientError,)
+
+    def __init__(self, reply=None, token_delay=0.0, latency=0.0, errors=None):
+        self.reply = reply
+        self.token_delay = token_delay
+        self.latency = latency
+        self.errors = list(errors or [])
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _reply_for(self, messages):
+        if self.reply is not None:
+            return self.reply
+        return "This is a local test reply to: " + messages[-1]["content"].strip().splitlines()[0].strip()
+
+    def _chunks(self, text):
+        words = text.split(" ")
+        for i, word in enumerate(words):
+            if self.token_delay:
+                time.sleep(self.token_delay)
+            token = word if i == len(words) - 1 else word + " "
+            yield {"choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]}
+        yield {"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+
+    def create(self, model, messages, temperature=None, stream=False, **kwargs):
+        with self._lock:
+            self.calls += 1
+            error = self.errors.pop(0) if self.errors else None
+        if self.latency:
+            time.sleep(self.latency)
+        if error is not None:
+            raise error
+        text = self._reply_for(messages)
+        if stream:
+            return self._chunks(text)
+        return {"choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}]}
+
+
+# Thread-safe token bucket: `rate` tokens are added per second up to `capacity`
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+# Function to configure openai to reuse pooled keep-alive connections
+def configure_openai_session(pool_size=LLM_POOL_SIZE):
+    import openai
+    import requests
+    from requests.adapters import HTTPAdapter
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    openai.requestssession = session
+    return session
+
+
+# Chat completion client shared by the whole process. Every call goes through
+# the rate limiter, carries a timeout, and is retried with jittered exponential
+# backoff on transient errors. `backend` is anything with a ChatCompletion-style create();
+# a backend other than openai's lists its transient errors in a `retryable_errors` attribute.
+class LLMClient:
+    def __init__(self, backend, timeout=LLM_TIMEOUT, max_retries=LLM_MAX_RETRIES, rate_limiter=None,
+                 max_workers=LLM_MAX_WORKERS, base_delay=0.5, max_delay=20.0):
+        self.backend = backend
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.rate_limiter = rate_limiter or TokenBucket(LLM_RATE_LIMIT, LLM_BURST)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm")
+        self.retryable_errors = getattr(backend, "retryable_errors", None) or retryable_errors()
+
+    def _backoff(self, attempt, error):
+        retry_after = getattr(error, "headers", None) or {}
+        retry_after = retry_after.get("retry-after") if hasattr(retry_after, "get") else None
+        try:
+            return min(self.max_delay, float(retry_after))
+        except (TypeError, ValueError):
+            # "Full jitter": spread retries from many sessions instead of retrying in lockstep
+            return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def create(self, **kwargs):
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire()
+            try:
+                return self.backend.create(request_timeout=self.timeout, **kwargs)
+            except self.retryable_errors as e:
+                if attempt >= self.max_retries:
+                    metrics.inc("llm_errors_total", error=type(e).__name__)
+                    raise
+                metrics.inc("llm_retries_total", error=type(e).__name__)
+                time.sleep(self._backoff(attempt, e))
+                attempt += 1
+
+    def chat_completion(self, messages, temperature=0.3, model=CHAT_MODEL):
+        response = self.create(model=model, messages=messages, temperature=temperature)
+        return response["choices"][0]["message"]["content"].strip()
+
+    def stream_chat_completion(self, messages, temperature=0.3, model=CHAT_MODEL):
+        # Only opening the stream is retried; a failure mid-stream propagates to the caller
+        for chunk in self.create(model=model, messages=messages, temperature=temperature, stream=True):
+            choices = chunk["choices"]
+            if not choices:
+                continue
+            token = choices[0].get("delta", {}).get("content")
+            if token:
+                yield token
+
+    def batch_chat_completions(self, messages_list, temperature=0.3, model=CHAT_MODEL):
+        # Runs the requests concurrently; a failed request yields its exception in place of the text
+        futures = [self.executor.submit(self.chat_completion, messages, temperature, model) for messages in messages_list]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append(e)
+        return results
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+# Function to get the process-wide LLM client for the configured backend
+def get_llm_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            if LLM_BACKEND == "fake":
+                _client = LLMClient(FakeStreamingClient())
+            else:
+                import openai
+                openai.api_key = os.getenv("OPENAI_API_KEY")
+                configure_openai_session()
+                _client = LLMClient(openai.ChatCompletion)
+        return _client
+
+
+# Function to replace the process-wide LLM client, e.g. with a stub backend in tests and benchmarks
+def set_llm_client(client):
+    global _client
+    with _client_lock:
+        _client = client
+
+
+# Function to request a chat completion and return its text
+def chat_completion(messages, temperature=0.3, model=CHAT_MODEL):
+    return get_llm_client().chat_completion(messages, temperature, model)
+
+
+# Function to stream a chat completion, yielding text fragments as they arrive
+def stream_chat_completion(messages, temperature=0.3, model=CHAT_MODEL):
+    return get_llm_client().stream_chat_completion(messages, temperature, model)
+
+
+# Function to run several chat completions concurrently
+def batch_chat_completions(messages_list, temperature=0.3, model=CHAT_MODEL):
+    return get_llm_client().batch_chat_completions(messages_list, temperature, model)
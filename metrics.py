@@ -0,0 +1,174 @@
+import os
+import json
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+METRICS_PREFIX = "dgp_"
+METRICS_JSON_LOG = os.getenv("METRICS_JSON_LOG", "0") == "1"  # log every span as one JSON line
+METRICS_RECENT_SPANS = int(os.getenv("METRICS_RECENT_SPANS", "200"))
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(label_key, extra=()):
+    pairs = list(label_key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def _percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+# Cumulative-bucket latency histogram, as Prometheus expects
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+# Process-wide registry of counters, latency histograms and callback gauges, plus the
+# most recent spans for the admin panel. Rendered as Prometheus text or a JSON snapshot.
+class Metrics:
+    def __init__(self, recent_spans=METRICS_RECENT_SPANS):
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self.recent = deque(maxlen=recent_spans)
+        self.recent_by_stage = {}
+        self._recent_spans = recent_spans
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    # fn() is called at render time; kind is "gauge" or "counter"
+    def register_gauge(self, name, fn, kind="gauge", **labels):
+        with self._lock:
+            self.gauges[(name, _label_key(labels))] = (fn, kind)
+
+    # Time a pipeline stage. The yielded dict can be filled with attributes
+    # (row counts, tokens, cache results) that are kept with the span.
+    @contextmanager
+    def span(self, stage, **attributes):
+        started = time.perf_counter()
+        error = None
+        try:
+            yield attributes
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            self.observe("stage_duration_seconds", elapsed, stage=stage)
+            if error:
+                self.inc("stage_errors_total", stage=stage, error=error)
+            record = {"stage": stage, "ms": round(elapsed * 1000, 3), "at": time.time(), **attributes}
+            if error:
+                record["error"] = error
+            with self._lock:
+                self.recent.append(record)
+                durations = self.recent_by_stage.get(stage)
+                if durations is None:
+                    durations = self.recent_by_stage[stage] = deque(maxlen=self._recent_spans)
+                durations.append(elapsed)
+            if METRICS_JSON_LOG:
+                logger.info(json.dumps(record, default=str))
+
+    def _gauge_values(self):
+        with self._lock:
+            gauges = list(self.gauges.items())
+        values = []
+        for (name, label_key), (fn, kind) in gauges:
+            try:
+                values.append((name, label_key, kind, float(fn())))
+            except Exception:
+                logger.exception("Metric callback %s failed", name)
+        return values
+
+    # Recent latency per stage (ms), slowest p95 first
+    def stage_summary(self):
+        with self._lock:
+            stages = {stage: list(durations) for stage, durations in self.recent_by_stage.items()}
+        summary = [
+            {
+                "stage": stage,
+                "count": len(durations),
+                "p50_ms": round(_percentile(durations, 0.5) * 1000, 3),
+                "p95_ms": round(_percentile(durations, 0.95) * 1000, 3),
+                "max_ms": round(max(durations) * 1000, 3),
+            }
+            for stage, durations in stages.items() if durations
+        ]
+        return sorted(summary, key=lambda row: row["p95_ms"], reverse=True)
+
+    def snapshot(self):
+        with self._lock:
+            counters = [{"name": name, "labels": dict(labels), "value": value} for (name, labels), value in self.counters.items()]
+            histograms = [{"name": name, "labels": dict(labels), "count": h.count, "sum": h.sum} for (name, labels), h in self.histograms.items()]
+            recent = list(self.recent)
+        gauges = [{"name": name, "labels": dict(labels), "value": value} for name, labels, kind, value in self._gauge_values()]
+        return {"counters": counters, "histograms": histograms, "gauges": gauges, "stages": self.stage_summary(), "recent": recent}
+
+    def render_prometheus(self):
+        lines = []
+        declared = set()
+
+        def declare(name, kind):
+            if name not in declared:
+                declared.add(name)
+                lines.append(f"# TYPE {METRICS_PREFIX}{name} {kind}")
+
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items(), key=lambda item: item[0])
+            histograms = [(key, h.buckets, list(h.counts), h.sum, h.count) for key, h in histograms]
+
+        for (name, labels), value in counters:
+            declare(name, "counter")
+            lines.append(f"{METRICS_PREFIX}{name}{_format_labels(labels)} {value}")
+        for (name, labels), buckets, counts, total, count in histograms:
+            declare(name, "histogram")
+            for bound, bucket_count in zip(buckets, counts):
+                lines.append(f"{METRICS_PREFIX}{name}_bucket{_format_labels(labels, [('le', bound)])} {bucket_count}")
+            lines.append(f"{METRICS_PREFIX}{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {count}")
+            lines.append(f"{METRICS_PREFIX}{name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{METRICS_PREFIX}{name}_count{_format_labels(labels)} {count}")
+        for name, labels, kind, value in sorted(self._gauge_values()):
+            declare(name, kind)
+            lines.append(f"{METRICS_PREFIX}{name}{_format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+span = metrics.span
@@ -0,0 +1,41 @@
+import os
+import time
+import sqlite3
+import threading
+
+POPULARITY_PATH = os.getenv("POPULARITY_PATH", os.path.join(".kb_cache", "popularity.sqlite3"))
+POPULARITY_WINDOW = float(os.getenv("POPULARITY_WINDOW", str(7 * 24 * 3600)))  # seconds of history that count
+
+
+# Query counts shared by every session and process, in one SQLite (WAL) table.
+# Queries are counted by their exact text (trimmed), since that is what the
+# answer cache keys on; queries not asked within the window stop counting.
+class PopularityStore:
+    def __init__(self, path=POPULARITY_PATH, window=POPULARITY_WINDOW):
+        self.window = window
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS queries (query TEXT PRIMARY KEY, count INTEGER NOT NULL, last_seen REAL NOT NULL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS queries_count ON queries (count)")
+        self.db.commit()
+
+    def record(self, query, count=1):
+        query = str(query).strip()
+        if not query:
+            return
+        with self._lock:
+            self.db.execute(
+                "INSERT INTO queries (query, count, last_seen) VALUES (?, ?, ?) "
+                "ON CONFLICT (query) DO UPDATE SET count = count + excluded.count, last_seen = excluded.last_seen",
+                (query, count, time.time()))
+            self.db.commit()
+
+    # The n most asked queries as (query, count), most asked first
+    def top(self, n):
+        with self._lock:
+            self.db.execute("DELETE FROM queries WHERE last_seen < ?", (time.time() - self.window,))
+            self.db.commit()
+            return self.db.execute("SELECT query, count FROM queries ORDER BY count DESC, last_seen DESC LIMIT ?", (n,)).fetchall()
@@ -0,0 +1,82 @@
+import os
+import time
+import logging
+import threading
+from conversation import opening_messages
+from metrics import metrics, span
+
+logger = logging.getLogger(__name__)
+
+PRECOMPUTE_TOP_N = int(os.getenv("PRECOMPUTE_TOP_N", "20"))  # most asked queries answered ahead of time
+PRECOMPUTE_INTERVAL = float(os.getenv("PRECOMPUTE_INTERVAL", "60"))  # seconds between refreshes; 0 disables
+
+
+# Answers the FAQ questions and the most asked queries ahead of time, as the first
+# question of a new conversation, so the answers are in the answer cache when a
+# session asks them. Refreshes on a background thread: a question is answered
+# again when the knowledge base changes, and its cached answer is regenerated
+# (bypassing the cache) once it is half-way to expiry.
+class AnswerPrecomputer:
+    def __init__(self, engine, top_n=PRECOMPUTE_TOP_N, interval=PRECOMPUTE_INTERVAL):
+        self.engine = engine
+        self.top_n = top_n
+        self.interval = interval
+        self.answered = {}  # question -> (knowledge-base version, time answered)
+        self._stop = threading.Event()
+        self.thread = None
+        metrics.register_gauge("precomputed_answers", lambda: len(self.answered))
+
+    # FAQ questions first, then the most asked queries not among them
+    def hot_questions(self):
+        questions = list(self.engine.faq_questions())
+        questions += [query for query, count in self.engine.popularity.top(self.top_n)]
+        return list(dict.fromkeys(questions))
+
+    def _is_fresh(self, question, version, now):
+        answered = self.answered.get(question)
+        return answered is not None and answered[0] == version and now - answered[1] < self.engine.answer_cache.ttl / 2
+
+    # Answer every hot question whose precomputed answer is missing or stale; returns how many were answered
+    def run_once(self):
+        version = self.engine.current().version
+        with span("precompute") as s:
+            questions = self.hot_questions()
+            # Forget questions that are no longer hot
+            self.answered = {q: self.answered[q] for q in questions if q in self.answered}
+            computed = 0
+            for question in questions:
+                if self._stop.is_set():
+                    break
+                if self._is_fresh(question, version, time.time()):
+                    continue
+                # Same knowledge base but past half the TTL: the cached answer is still valid, so regenerate it
+                stale = self.answered.get(question, (None,))[0] == version
+                try:
+                    answer = self.engine.answer(question, opening_messages(question), refresh=stale)
+                except Exception:
+                    logger.exception("Could not precompute the answer to %r", question)
+                    metrics.inc("precompute_errors_total")
+                    continue
+                self.answered[question] = (version, time.time())
+                computed += not answer.cached
+            s["questions"] = len(questions)
+            s["computed"] = computed
+        metrics.inc("precomputed_answers_total", computed)
+        return computed
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("Answer precomputation failed")
+            self._stop.wait(self.interval)
+
+    def start(self):
+        if self.interval > 0 and self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="answer-precompute", daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,164 @@
+import re
+import math
+import heapq
+from collections import Counter, defaultdict
+from knowledge_base import SEARCH_COLUMNS
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset("""
+a an and are as at be but by can do does for from how i if in is it its may me my no not of on or
+our please so that the their there this to was we what when where which who why will with would you your
+""".split())
+
+
+# Function to lowercase text and split it into searchable tokens
+def tokenize(text):
+    return [token for token in TOKEN_PATTERN.findall(str(text).lower()) if token not in STOPWORDS]
+
+
+# Inverted index over knowledge-base rows with BM25 scoring.
+# Postings map each term to (document, term frequency) pairs, so a query only
+# touches the documents that share at least one term with it. Each document
+# is one knowledge-base row (by default the row with the same number).
+class InvertedIndex:
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(list)
+        self.doc_lengths = []
+        self.doc_rows = []
+        self.total_length = 0
+        self.posting_count = 0
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def add(self, text, row=None):
+        doc_id = len(self.doc_lengths)
+        tokens = tokenize(text)
+        # Length and row first: a concurrent search can then never see a posting without its document
+        self.doc_lengths.append(len(tokens))
+        self.doc_rows.append(doc_id if row is None else row)
+        self.total_length += len(tokens)
+        counts = Counter(tokens)
+        for term, tf in counts.items():
+            self.postings[term].append((doc_id, tf))
+        self.posting_count += len(counts)
+        return doc_id
+
+    def idf(self, term):
+        df = len(self.postings.get(term, ()))
+        return math.log(1 + (len(self.doc_lengths) - df + 0.5) / (df + 0.5))
+
+    def search(self, query, k=5):
+        if not self.doc_lengths:
+            return []
+
+        avg_length = self.total_length / len(self.doc_lengths) or 1.0
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = self.idf(term)
+            for doc_id, tf in postings:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / avg_length)
+                scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+
+        top = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [(self.doc_rows[doc_id], score) for doc_id, score in top]
+
+
+# Function to build a search index over the precomputed search text of the given rows
+# (every row by default), or to extend an existing index with the rows from `start` on
+# (indexes are append-only)
+def build_search_index(kb, index=None, start=0, rows=None):
+    if index is None:
+        index = InvertedIndex()
+    if rows is None:
+        rows = range(start, len(kb))
+    for row in rows:
+        index.add(kb.search_text[row], row)
+    return index
+
+
+# Function to split text into padded character trigrams for candidate blocking
+def trigrams(text):
+    tokens = TOKEN_PATTERN.findall(str(text).lower())
+    if not tokens:
+        return set()
+    padded = f"  {' '.join(tokens)} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+# Top-k fuzzy matcher over several text fields per row.
+# Candidates are first blocked on shared character trigrams, and only the
+# best-overlapping shortlist is scored with the exact fuzzywuzzy scorer.
+class FuzzyMatcher:
+    def __init__(self, shortlist_size=50, max_df=0.5, scorer=None):
+        if scorer is None:
+            # fuzzywuzzy is imported on first use, keeping it off the startup path
+            from fuzzywuzzy import fuzz
+            scorer = fuzz.WRatio
+        self.shortlist_size = shortlist_size
+        self.max_df = max_df
+        self.scorer = scorer
+        self.texts = []
+        self.rows = []
+        self.gram_counts = []
+        self.postings = defaultdict(list)
+
+    def add(self, text, row):
+        text = str(text)
+        grams = trigrams(text)
+        if not text.strip() or not grams:
+            return
+        entry_id = len(self.texts)
+        self.texts.append(text)
+        self.rows.append(row)
+        self.gram_counts.append(len(grams))
+        for gram in grams:
+            self.postings[gram].append(entry_id)
+
+    def _candidates(self, query_grams):
+        # Grams shared by most entries carry no signal; skip them unless nothing else matches
+        limit = max(1, int(self.max_df * len(self.texts)))
+        grams = [gram for gram in query_grams if gram in self.postings]
+        selective = [gram for gram in grams if len(self.postings[gram]) <= limit] or grams
+
+        overlap = Counter()
+        for gram in selective:
+            overlap.update(self.postings[gram])
+
+        # Dice coefficient on trigram sets, so long entries are not favoured
+        return heapq.nlargest(
+            self.shortlist_size,
+            overlap,
+            key=lambda entry_id: 2 * overlap[entry_id] / (len(query_grams) + self.gram_counts[entry_id]),
+        )
+
+    def search(self, query, k=5):
+        query_grams = trigrams(query)
+        if not self.texts or not query_grams:
+            return []
+
+        best = {}
+        for entry_id in self._candidates(query_grams):
+            score = self.scorer(query, self.texts[entry_id])
+            row = self.rows[entry_id]
+            if score > best.get(row, -1):
+                best[row] = score
+
+        return heapq.nlargest(k, best.items(), key=lambda item: item[1])
+
+
+# Function to build a fuzzy matcher whose Details of Query and Subject entries both map back to their row
+def build_fuzzy_matcher(kb, columns=SEARCH_COLUMNS, matcher=None, start=0, rows=None):
+    if matcher is None:
+        matcher = FuzzyMatcher()
+    if rows is None:
+        rows = range(start, len(kb))
+    for column in columns:
+        for row in rows:
+            matcher.add(kb.text(column, row), row)
+    return matcher
@@ -0,0 +1,123 @@
+import os
+import zlib
+import hashlib
+import numpy as np
+from retrieval import TOKEN_PATTERN, tokenize
+
+# Local sentence-transformers model directory; when unset the hashing embedder is used
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL")
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", ".kb_cache")
+
+
+# Offline embedder that hashes word and character n-gram features into a
+# fixed number of dimensions. It needs no model download or fitting, so the
+# same text always maps to the same vector in every process.
+class HashingEmbedder:
+    def __init__(self, dim=1024, char_ngram=4, char_weight=0.5):
+        self.dim = dim
+        self.char_ngram = char_ngram
+        self.char_weight = char_weight
+        self.name = f"hashing-{dim}-{char_ngram}"
+
+    def _features(self, text):
+        words = tokenize(text)
+        for word in words:
+            yield word, 1.0
+        for first, second in zip(words, words[1:]):
+            yield f"{first} {second}", 1.0
+        # Character n-grams let "login"/"logging" or typos share dimensions
+        for word in TOKEN_PATTERN.findall(str(text).lower()):
+            padded = f"<{word}>"
+            for i in range(max(1, len(padded) - self.char_ngram + 1)):
+                yield "#" + padded[i:i + self.char_ngram], self.char_weight
+
+    def embed(self, texts):
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for feature, weight in self._features(text):
+                h = zlib.crc32(feature.encode('utf-8'))
+                matrix[i, h % self.dim] += weight if h & 0x80000000 else -weight
+        # Sublinear term frequency, then unit length so a dot product is cosine similarity
+        np.copyto(matrix, np.sign(matrix) * np.log1p(np.abs(matrix)))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+
+# Embedder backed by a sentence-transformers model loaded from a local path
+class SentenceTransformerEmbedder:
+    def __init__(self, model_path):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_path, device="cpu")
+        self.name = "st-" + os.path.basename(os.path.normpath(model_path))
+
+    def embed(self, texts):
+        return self.model.encode(list(texts), normalize_embeddings=True, convert_to_numpy=True).astype(np.float32)
+
+
+# Function to pick the embedding backend, falling back to hashing when no local model is usable
+def get_embedder(model_path=EMBEDDING_MODEL):
+    if model_path:
+        try:
+            return SentenceTransformerEmbedder(model_path)
+        except Exception:
+            pass
+    return HashingEmbedder()
+
+
+# Row embeddings held as one float32 matrix; a query is one matrix-vector product
+class EmbeddingIndex:
+    def __init__(self, embedder, matrix, rows=None):
+        self.embedder = embedder
+        self.matrix = matrix
+        # Knowledge-base row of each matrix row, when not every row is embedded
+        self.rows = None if rows is None else np.asarray(rows, dtype=np.int64)
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    def search(self, query, k=5, min_score=0.1):
+        if not len(self):
+            return []
+        scores = self.matrix @ self.embedder.embed([query])[0]
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        rows = top if self.rows is None else self.rows[top]
+        return [(int(row), float(scores[i])) for i, row in zip(top, rows) if scores[i] >= min_score]
+
+    # New index with rows appended; only the new texts are embedded
+    def extend(self, texts, rows=None):
+        matrix = self.embedder.embed([str(text) for text in texts]).astype(np.float32)
+        if self.rows is not None or rows is not None:
+            old_rows = np.arange(len(self)) if self.rows is None else self.rows
+            new_rows = np.arange(len(self), len(self) + len(matrix)) if rows is None else rows
+            rows = np.concatenate([old_rows, np.asarray(new_rows, dtype=np.int64)])
+        return EmbeddingIndex(self.embedder, np.vstack([self.matrix, matrix]), rows)
+
+
+# Function to embed every row (or the given rows) once per knowledge-base version and
+# memory-map the result from disk
+def load_or_build_embedding_index(kb, version, embedder=None, cache_dir=EMBEDDING_CACHE_DIR, rows=None):
+    embedder = embedder or get_embedder()
+    # The key covers which rows are embedded, not just how many, so a different dedupe selection is rebuilt
+    embedded = "all" if rows is None else hashlib.sha1(np.asarray(rows, dtype=np.int64).tobytes()).hexdigest()
+    key = hashlib.sha1(f"{version}|{embedder.name}|{len(kb)}|{embedded}".encode('utf-8')).hexdigest()[:16]
+    path = os.path.join(cache_dir, f"embeddings-{key}.npy")
+
+    try:
+        return EmbeddingIndex(embedder, np.load(path, mmap_mode='r'), rows)
+    except (OSError, ValueError):
+        pass
+
+    texts = [str(text) for text in kb.search_text] if rows is None else [str(kb.search_text[row]) for row in rows]
+    matrix = embedder.embed(texts).astype(np.float32)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(path + ".tmp", 'wb') as f:
+            np.save(f, matrix)
+        os.replace(path + ".tmp", path)
+        matrix = np.load(path, mmap_mode='r')
+    except OSError:
+        pass
+    return EmbeddingIndex(embedder, matrix, rows)
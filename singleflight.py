@@ -0,0 +1,97 @@
+import threading
+from metrics import metrics
+
+
+# One in-flight computation. A streaming computation publishes its fragments as
+# they arrive, so every caller can replay them instead of waiting for the result.
+class Flight:
+    def __init__(self):
+        self.parts = []
+        self.result = None
+        self.error = None
+        self.done = False
+        self.followers = 0
+        self._changed = threading.Condition()
+
+    def publish(self, part):
+        with self._changed:
+            self.parts.append(part)
+            self._changed.notify_all()
+
+    def _finish(self, result=None, error=None):
+        with self._changed:
+            self.result = result
+            self.error = error
+            self.done = True
+            self._changed.notify_all()
+
+    # Block until the leader finishes; returns its result or raises its error
+    def wait(self):
+        with self._changed:
+            self._changed.wait_for(lambda: self.done)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    # Yield the published fragments, those already published first, until the flight
+    # finishes; a flight that published nothing yields its result as one fragment
+    def follow(self):
+        seen = 0
+        while True:
+            with self._changed:
+                self._changed.wait_for(lambda: self.done or len(self.parts) > seen)
+                parts = self.parts[seen:]
+                done = self.done
+            seen += len(parts)
+            yield from parts
+            if done:
+                if self.error is not None:
+                    raise self.error
+                if not seen and self.result:
+                    yield self.result
+                return
+
+
+# Process-wide coalescing of identical concurrent work: the first caller for a key
+# (the leader) runs it, callers arriving while it runs (followers) share its
+# result. Nothing is kept once the leader finishes; the answer cache does that.
+class SingleFlight:
+    def __init__(self, name):
+        self.name = name
+        self.flights = {}
+        self._lock = threading.Lock()
+
+    # The flight for key and whether the caller leads it; the leader must call finish()
+    def join(self, key):
+        with self._lock:
+            flight = self.flights.get(key)
+            if flight is not None:
+                flight.followers += 1
+                metrics.inc("singleflight_coalesced_total", flight=self.name)
+                return flight, False
+            flight = self.flights[key] = Flight()
+        metrics.inc("singleflight_leaders_total", flight=self.name)
+        return flight, True
+
+    def finish(self, key, flight, result=None, error=None):
+        with self._lock:
+            if self.flights.get(key) is flight:
+                del self.flights[key]
+        flight._finish(result, error)
+
+    # Run fn() once for all concurrent callers with the same key
+    def do(self, key, fn):
+        flight, leader = self.join(key)
+        if not leader:
+            return flight.wait()
+        try:
+            result = fn()
+        except Exception as e:
+            self.finish(key, flight, error=e)
+            raise
+        self.finish(key, flight, result)
+        return result
+
+    def in_flight(self):
+        with self._lock:
+            return len(self.flights)
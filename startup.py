@@ -0,0 +1,63 @@
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+# Loads the chat engine on a background thread so the page (and password gate)
+# can render before the heavy imports, the S3 read, the index build and the FAQ
+# generation have finished. `stage` describes the step in progress for placeholders.
+class EngineWarmup:
+    def __init__(self, load_faq=True, precompute=True):
+        self.load_faq = load_faq
+        self.precompute = precompute
+        self.stage = "Starting"
+        self.engine = None
+        self.error = None
+        self.faq = None
+        self.faq_error = None
+        self.ready = threading.Event()
+        self.faq_ready = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="engine-warmup", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        try:
+            self.stage = "Loading libraries"
+            from engine import get_engine
+            engine = get_engine()
+            self.stage = "Loading the knowledge base"
+            engine.current()
+            self.engine = engine
+        except Exception as e:
+            logger.exception("Could not load the chat engine")
+            self.error = e
+            self.faq_error = e
+        finally:
+            self.ready.set()
+
+        if self.engine is not None and self.load_faq:
+            try:
+                self.stage = "Preparing frequently asked questions"
+                self.faq = self.engine.faq_questions()
+            except Exception as e:
+                logger.exception("Could not build the FAQ questions")
+                self.faq_error = e
+        self.stage = "Ready"
+        self.faq_ready.set()
+
+        # Answer the FAQ and the most asked queries ahead of time, refreshed as the data changes
+        if self.engine is not None and self.precompute and self.faq_error is None:
+            self.engine.start_precompute()
+
+    @property
+    def failed(self):
+        return self.ready.is_set() and self.error is not None
+
+    # Block until the engine is loaded and return it, re-raising any load error
+    def wait(self, timeout=None):
+        if not self.ready.wait(timeout):
+            raise TimeoutError(f"{self.stage} is taking longer than {timeout} seconds")
+        if self.error is not None:
+            raise self.error
+        return self.engine
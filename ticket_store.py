@@ -0,0 +1,195 @@
+import os
+import csv
+import json
+import queue
+import atexit
+import sqlite3
+import threading
+import datetime
+import uuid
+import logging
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+TICKET_DB_PATH = os.getenv("TICKET_DB_PATH", "tickets.sqlite3")
+TICKET_CATEGORY = os.getenv("TICKET_CATEGORY", "DGP")
+
+# Column order of user_log.csv, used for exports
+LOG_COLUMNS = ["Sub Category", "Number", "Subject", "Opened Date/Time", "Category", "Details of Query"]
+
+_INSERT = "INSERT INTO tickets (number, sub_category, subject, opened_at, category, details, transcript) VALUES (?, ?, ?, ?, ?, ?, ?)"
+_STOP = object()  # queued by close() to stop the writer once everything before it is written
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tickets (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    number TEXT NOT NULL UNIQUE,
+    sub_category TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    opened_at TEXT NOT NULL,
+    category TEXT NOT NULL,
+    details TEXT NOT NULL,
+    transcript TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tickets_opened_at ON tickets (opened_at);
+CREATE INDEX IF NOT EXISTS tickets_sub_category ON tickets (sub_category);
+"""
+
+
+# Function to generate a ticket number, e.g. DGP-20240101-3f2a9c1b
+def new_ticket_number(opened_at=None):
+    opened_at = opened_at or datetime.datetime.now()
+    return f"DGP-{opened_at:%Y%m%d}-{uuid.uuid4().hex[:8]}"
+
+
+# Append-only SQLite (WAL) store for tickets logged from the chat.
+# submit() only enqueues; a background thread batches queued tickets into
+# one transaction, so the UI never waits on disk. Queued tickets are written
+# before the process exits; status() tells whether a ticket has been written
+# yet, and tickets that could not be written are kept in `failed`
+# (number -> error) so the page can report them.
+class TicketStore:
+    def __init__(self, path=TICKET_DB_PATH, batch_size=100):
+        self.path = path
+        self.batch_size = batch_size
+        self.queue = queue.Queue()
+        self.failed = {}
+        self.pending = {}  # number -> Event set once the ticket's write has been attempted
+        self.closed = False
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        db = self._connect()
+        db.executescript(_SCHEMA)
+        db.close()
+        self._writer = threading.Thread(target=self._run, name="ticket-writer", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def submit(self, sub_category, subject, details, transcript, opened_at=None, category=TICKET_CATEGORY):
+        if self.closed:
+            raise RuntimeError("The ticket store is closed")
+        opened_at = opened_at or datetime.datetime.now()
+        number = new_ticket_number(opened_at)
+        self.pending[number] = threading.Event()
+        self.queue.put((
+            number,
+            sub_category,
+            subject,
+            opened_at.strftime("%Y-%m-%d %H:%M:%S"),
+            category,
+            details,
+            json.dumps(transcript, ensure_ascii=False),
+        ))
+        return number
+
+    def _run(self):
+        db = self._connect()
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            tickets = [ticket for ticket in batch if ticket is not _STOP]
+            try:
+                if tickets:
+                    self._write(db, tickets)
+            finally:
+                for ticket in tickets:
+                    event = self.pending.pop(ticket[0], None)
+                    if event is not None:
+                        event.set()
+                for _ in batch:
+                    self.queue.task_done()
+            if len(tickets) < len(batch):
+                db.close()
+                return
+
+    def _write(self, db, tickets):
+        try:
+            with db:
+                db.executemany(_INSERT, tickets)
+            return
+        except Exception:
+            logger.exception("Failed to write %d ticket(s); retrying them one at a time", len(tickets))
+        # One bad ticket should not lose the rest of the batch
+        for ticket in tickets:
+            try:
+                with db:
+                    db.execute(_INSERT, ticket)
+            except Exception as e:
+                logger.error("Could not write ticket %s: %s", ticket[0], e)
+                self.failed[ticket[0]] = str(e)
+                metrics.inc("ticket_write_errors_total")
+
+    # Wait up to timeout seconds for a submitted ticket's write: "written", "failed" or still "queued"
+    def status(self, number, timeout=0):
+        event = self.pending.get(number)
+        if event is not None and not event.wait(timeout):
+            return "queued"
+        return "failed" if number in self.failed else "written"
+
+    # Block until every submitted ticket has been written
+    def flush(self):
+        self.queue.join()
+
+    # Write whatever is queued and stop the writer; registered to run at exit
+    def close(self, timeout=30):
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(_STOP)
+        self._writer.join(timeout)
+        if self._writer.is_alive():
+            logger.error("Timed out writing %d queued ticket(s)", self.queue.qsize())
+
+    def query(self, since=None, sub_category=None, limit=None):
+        sql = "SELECT sub_category, number, subject, opened_at, category, details, transcript FROM tickets WHERE 1 = 1"
+        params = []
+        if since is not None:
+            sql += " AND opened_at >= ?"
+            params.append(since)
+        if sub_category is not None:
+            sql += " AND sub_category = ?"
+            params.append(sub_category)
+        sql += " ORDER BY opened_at"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        db = self._connect()
+        try:
+            yield from db.execute(sql, params)
+        finally:
+            db.close()
+
+    # Export tickets in the user_log.csv format (transcript excluded), streaming rows to disk
+    def export_csv(self, path, since=None, sub_category=None, encoding='cp1252'):
+        self.flush()
+        count = 0
+        with open(path, 'w', newline='', encoding=encoding, errors='replace') as f:
+            writer = csv.writer(f)
+            writer.writerow(LOG_COLUMNS)
+            for row in self.query(since, sub_category):
+                writer.writerow(row[:6])
+                count += 1
+        return count
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Export logged tickets in the user_log.csv format.")
+    parser.add_argument("output", help="CSV file to write, e.g. user_log.csv")
+    parser.add_argument("--db", default=TICKET_DB_PATH, help=f"ticket database (default: {TICKET_DB_PATH})")
+    parser.add_argument("--since", help="only tickets opened at or after this 'YYYY-MM-DD HH:MM:SS'")
+    parser.add_argument("--sub-category", help="only tickets in this sub category")
+    args = parser.parse_args()
+    print(f"Exported {TicketStore(args.db).export_csv(args.output, args.since, args.sub_category)} tickets to {args.output}")